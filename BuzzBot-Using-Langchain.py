@@ -3,6 +3,25 @@ import datetime
 import uuid
 import warnings
 import logging
+import gzip
+import json
+import asyncio
+import hashlib
+import re
+import random
+import queue
+import sys
+import csv
+import argparse
+import sqlite3
+import time
+import urllib.parse
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+from collections import OrderedDict
+import numpy as np
 
 # Suppress warnings
 warnings.filterwarnings("ignore", message=".*LangSmith now uses UUID v7.*")
@@ -11,22 +30,31 @@ logging.getLogger("langsmith").setLevel(logging.ERROR)
 
 # Environment & Database
 from dotenv import load_dotenv
-from pymongo import MongoClient, errors
+from pymongo import MongoClient, errors, monitoring
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk, ToolMessage, messages_from_dict
+from langchain_core.language_models.chat_models import BaseChatModel, generate_from_stream
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
 from langchain_mongodb import MongoDBChatMessageHistory
 
 #Embeddings & Vector Store
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_text_splitters import RecursiveCharacterTextSplitter, MarkdownHeaderTextSplitter
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
 from langchain_community.vectorstores import FAISS
+import faiss
 from langchain_community.document_loaders import (
     PyPDFLoader, TextLoader, UnstructuredWordDocumentLoader, DirectoryLoader, CSVLoader
 )
 #Agent & Tooling
 from pydantic import BaseModel, Field
-from langchain_core.tools import tool
+from langchain_core.tools import tool, StructuredTool
 from langchain_classic.agents import AgentExecutor
 from langchain_classic.agents import create_tool_calling_agent
 from langchain_community.utilities import SerpAPIWrapper
@@ -40,6 +68,13 @@ def load_app_configuration():
         
         appConfig = {
             "MongoUrl": os.getenv("mongo_url"),
+            "MongoMaxPoolSize": int(os.getenv("mongo_max_pool_size",50)),
+            "MongoMinPoolSize": int(os.getenv("mongo_min_pool_size",0)),
+            "MongoMaxIdleTimeMs": int(os.getenv("mongo_max_idle_time_ms",60000)),
+            "MongoWaitQueueTimeoutMs": int(os.getenv("mongo_wait_queue_timeout_ms",2000)),
+            "MongoConnectTimeoutMs": int(os.getenv("mongo_connect_timeout_ms",5000)),
+            "MongoSocketTimeoutMs": int(os.getenv("mongo_socket_timeout_ms",20000)),
+            "MongoServerSelectionTimeoutMs": int(os.getenv("mongo_server_selection_timeout_ms",5000)),
             "GoogleApiKey": os.getenv("google_api_key"),
             "SerpApiKey": os.getenv("serpapi_api_key"),
             "DbName": os.getenv("db_name"),
@@ -50,14 +85,87 @@ def load_app_configuration():
             "VectorStoreRoot": os.getenv("vector_store_root"),
             "ChunkSize": int(os.getenv("chunk_size",1000)),
             "ChunkOverlap": int(os.getenv("chunk_overlap",100)),
+            "ParentDocumentRetrieval": os.getenv("parent_document_retrieval", "true").lower() == "true",
+            "ChildChunkSize": int(os.getenv("child_chunk_size",300)),
+            "ChildChunkOverlap": int(os.getenv("child_chunk_overlap",30)),
             "LlmModel": os.getenv("llm_model"),
             "LlmTemperature": float(os.getenv("llm_temperature",0.3)),
+            "LlmApiEndpoint": os.getenv("llm_api_endpoint"),
+            "LlmBackend": os.getenv("llm_backend", "gemini").lower(),
+            "SearchBackend": os.getenv("search_backend", "serpapi").lower(),
+            "SerpApiEndpoint": os.getenv("serpapi_endpoint"),
+            "FakeLatencyMeanSeconds": float(os.getenv("fake_latency_mean_seconds",0.8)),
+            "FakeLatencyStdSeconds": float(os.getenv("fake_latency_std_seconds",0.3)),
+            "FakeLatencyDistribution": os.getenv("fake_latency_distribution", "lognormal").lower(),
+            "FakeLlmScriptPath": os.getenv("fake_llm_script_path"),
+            "FakeSeed": int(os.getenv("fake_seed",42)),
+            "LlmTurnDeadlineSeconds": float(os.getenv("llm_turn_deadline_seconds",60)),
+            "LlmAttemptTimeoutSeconds": float(os.getenv("llm_attempt_timeout_seconds",30)),
+            "LlmMaxRetries": int(os.getenv("llm_max_retries",2)),
+            "LlmBackoffBaseSeconds": float(os.getenv("llm_backoff_base_seconds",0.5)),
+            "LlmHedgingEnabled": os.getenv("llm_hedging_enabled", "false").lower() == "true",
+            "LlmHedgeMinSamples": int(os.getenv("llm_hedge_min_samples",20)),
+            "LlmCacheEnabled": os.getenv("llm_cache_enabled", "true").lower() == "true",
+            "LlmCachePath": os.getenv("llm_cache_path", os.path.join(os.getenv("vector_store_root", ""), "llm_cache.sqlite")),
+            "LlmCacheTtlSeconds": int(os.getenv("llm_cache_ttl_seconds",86400)),
+            "LlmCacheMaxEntries": int(os.getenv("llm_cache_max_entries",5000)),
+            "WebSearchCacheEnabled": os.getenv("web_search_cache_enabled", "true").lower() == "true",
+            "WebSearchCachePath": os.getenv("web_search_cache_path", os.path.join(os.getenv("vector_store_root", ""), "web_search_cache.sqlite")),
+            "WebSearchCacheTtlSeconds": int(os.getenv("web_search_cache_ttl_seconds",21600)),
+            "WebSearchNegativeTtlSeconds": int(os.getenv("web_search_negative_ttl_seconds",1800)),
+            "WebSearchCacheMaxEntries": int(os.getenv("web_search_cache_max_entries",5000)),
+            "SemanticCacheEnabled": os.getenv("semantic_cache_enabled", "false").lower() == "true",
+            "SemanticCacheThreshold": float(os.getenv("semantic_cache_threshold",0.92)),
             "RetrieverK": int(os.getenv("retriever_k",5)),
+            "HistoryTokenBudget": int(os.getenv("history_token_budget",2000)),
+            "HistoryFetchLimit": int(os.getenv("history_fetch_limit",40)),
+            "HistorySummaryEnabled": os.getenv("history_summary_enabled", "true").lower() == "true",
+            "HistorySummaryTrigger": int(os.getenv("history_summary_trigger",6)),
+            "QueryEmbeddingCacheSize": int(os.getenv("query_embedding_cache_size",1024)),
+            "RetrieverScoreThreshold": float(os.getenv("retriever_score_threshold",0.3)),
+            "RetrieverScoreGap": float(os.getenv("retriever_score_gap",0.15)),
+            "RetrieverContextChars": int(os.getenv("retriever_context_chars",2500)),
+            "ContextCompressionEnabled": os.getenv("context_compression_enabled", "true").lower() == "true",
+            "ContextTokenBudget": int(os.getenv("context_token_budget",600)),
+            "DocumentTopN": int(os.getenv("document_top_n",3)),
+            "RelevanceGateEnabled": os.getenv("relevance_gate_enabled", "true").lower() == "true",
+            "RelevanceGateThreshold": float(os.getenv("relevance_gate_threshold",0.55)),
+            "RelevanceCrossEncoderModel": os.getenv("relevance_cross_encoder_model", ""),
+            "RelevanceLogEnabled": os.getenv("relevance_log_enabled", "true").lower() == "true",
+            "RelevanceLabelSimilarity": float(os.getenv("relevance_label_similarity",0.6)),
             "AgentMaxIterations": int(os.getenv("agent_max_iterations",5)),
-            "AgentVerbose": os.getenv("agent_verbose", "true").lower() == "true"
+            "AgentVerbose": os.getenv("agent_verbose", "false").lower() == "true",
+            "AgentMaxSeconds": float(os.getenv("agent_max_seconds",20)),
+            "ProviderPromptCacheEnabled": os.getenv("provider_prompt_cache_enabled", "false").lower() == "true",
+            "ProviderPromptCacheEndpoint": os.getenv("provider_prompt_cache_endpoint", os.getenv("llm_api_endpoint") or "https://generativelanguage.googleapis.com"),
+            "ProviderPromptCacheTtlSeconds": int(os.getenv("provider_prompt_cache_ttl_seconds",3600)),
+            "AgentEventLogPath": os.getenv("agent_event_log_path", "agent_events.jsonl"),
+            "StreamResponses": os.getenv("stream_responses", "true").lower() == "true",
+            "QueryRewriteEnabled": os.getenv("query_rewrite_enabled", "true").lower() == "true",
+            "FollowUpCentroidThreshold": float(os.getenv("follow_up_centroid_threshold",0.25)),
+            "FollowUpShortQueryThreshold": float(os.getenv("follow_up_short_query_threshold",0.4)),
+            "SpeculativeRetrievalEnabled": os.getenv("speculative_retrieval_enabled", "true").lower() == "true",
+            "PrefetchSimilarityThreshold": float(os.getenv("prefetch_similarity_threshold",0.9)),
+            "PrefetchTtlSeconds": float(os.getenv("prefetch_ttl_seconds",60)),
+            "FastPathEnabled": os.getenv("fast_path_enabled", "true").lower() == "true",
+            "RouterMetaThreshold": float(os.getenv("router_meta_threshold",0.8)),
+            "RouterRagThreshold": float(os.getenv("router_rag_threshold",0.75)),
+            "AsyncAgentExecution": os.getenv("async_agent_execution", "true").lower() == "true",
+            "DocumentSearchTimeout": float(os.getenv("document_search_timeout",10)),
+            "WebSearchTimeout": float(os.getenv("web_search_timeout",15)),
+            "WebIngestEnabled": os.getenv("web_ingest_enabled", "true").lower() == "true",
+            "WebIngestTtlSeconds": int(os.getenv("web_ingest_ttl_seconds",604800)),
+            "WebSupplementK": int(os.getenv("web_supplement_k",3)),
+            "WebSearchDeadlineSeconds": float(os.getenv("web_search_deadline_seconds",8)),
+            "WebSearchBreakerFailures": int(os.getenv("web_search_breaker_failures",3)),
+            "WebSearchBreakerCooldownSeconds": float(os.getenv("web_search_breaker_cooldown_seconds",60)),
+            "BatchConcurrency": int(os.getenv("batch_concurrency",4)),
+            "WarmupEnabled": os.getenv("warmup_enabled", "false").lower() == "true",
+            "WarmupFolderCount": int(os.getenv("warmup_folder_count",3))
         }
 
-        if not appConfig["MongoUrl"] or not appConfig["GoogleApiKey"]:
+        # The Google key is not needed when the local fake LLM backend is selected
+        if not appConfig["MongoUrl"] or (not appConfig["GoogleApiKey"] and appConfig["LlmBackend"] != "fake"):
             print("Error: Missing API Keys in .env file.")
             exit()
 
@@ -69,9 +177,101 @@ def load_app_configuration():
         print(f"Error loading configuration: {e}")
         exit()
 
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Counts connection pool events of the shared MongoClient."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {"Created": 0, "Closed": 0, "CheckedOut": 0, "CheckedIn": 0, "CheckOutFailed": 0, "PoolCleared": 0}
+        self.checkoutStartedAt = {}
+        self.checkoutWaitMs = deque(maxlen=1000)
+
+    def count(self, counterName):
+        with self.lock:
+            self.counters[counterName] += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.count("PoolCleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.count("Created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.count("Closed")
+
+    def connection_check_out_started(self, event):
+        with self.lock:
+            self.checkoutStartedAt[threading.get_ident()] = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self.checkoutStartedAt.pop(threading.get_ident(), None)
+        self.count("CheckOutFailed")
+
+    def connection_checked_out(self, event):
+        with self.lock:
+            startedAt = self.checkoutStartedAt.pop(threading.get_ident(), None)
+            if startedAt is not None:
+                self.checkoutWaitMs.append((time.perf_counter() - startedAt) * 1000)
+        self.count("CheckedOut")
+
+    def connection_checked_in(self, event):
+        self.count("CheckedIn")
+
+    def snapshot(self):
+        """Current pool counters: open and in-use connections, failures and checkout wait times."""
+        with self.lock:
+            waits = sorted(self.checkoutWaitMs)
+            return {
+                **self.counters,
+                "Open": self.counters["Created"] - self.counters["Closed"],
+                "InUse": self.counters["CheckedOut"] - self.counters["CheckedIn"],
+                "CheckoutWaitP50Ms": round(waits[len(waits) // 2], 2) if waits else None,
+                "CheckoutWaitMaxMs": round(waits[-1], 2) if waits else None
+            }
+
+# One MongoClient (and connection pool) per process, shared by every database access
+MONGO_CLIENT = None
+MONGO_CLIENT_LOCK = threading.Lock()
+MONGO_POOL_METRICS = MongoPoolMetrics()
+
+def get_mongo_client(appConfig):
+    """Returns the process-wide MongoClient, creating it with the configured pool settings on first use."""
+    global MONGO_CLIENT
+    with MONGO_CLIENT_LOCK:
+        if MONGO_CLIENT is None:
+            MONGO_CLIENT = MongoClient(
+                appConfig["MongoUrl"],
+                maxPoolSize=appConfig["MongoMaxPoolSize"],
+                minPoolSize=appConfig["MongoMinPoolSize"],
+                maxIdleTimeMS=appConfig["MongoMaxIdleTimeMs"],
+                waitQueueTimeoutMS=appConfig["MongoWaitQueueTimeoutMs"],
+                connectTimeoutMS=appConfig["MongoConnectTimeoutMs"],
+                socketTimeoutMS=appConfig["MongoSocketTimeoutMs"],
+                serverSelectionTimeoutMS=appConfig["MongoServerSelectionTimeoutMs"],
+                event_listeners=[MONGO_POOL_METRICS]
+            )
+        return MONGO_CLIENT
+
+def get_mongo_pool_metrics():
+    """Returns a snapshot of the shared client's connection pool metrics."""
+    return MONGO_POOL_METRICS.snapshot()
+
 def connect_to_mongodb(appConfig):
     try:
-        mongoClient = MongoClient(appConfig["MongoUrl"], serverSelectionTimeoutMS=5000)
+        mongoClient = get_mongo_client(appConfig)
         mongoClient.server_info() 
         return mongoClient[appConfig["DbName"]]
     except errors.ServerSelectionTimeoutError:
@@ -114,6 +314,17 @@ def fetch_all_sessions(mongoDatabase):
         print(f"Error fetching all sessions: {e}")
         return []
 
+def save_session_summary(mongoDatabase, sessionId, runningSummary, summarizedCount):
+    """Stores the running summary and how many messages it covers in the session metadata."""
+    try:
+        mongoDatabase["SessionMetadata"].update_one(
+            {"SessionId": sessionId},
+            {"$set": {"RunningSummary": runningSummary, "SummarizedCount": summarizedCount}},
+            upsert=True
+        )
+    except Exception as e:
+        print(f"Error saving session summary: {e}")
+
 def fetch_session_details(mongoDatabase, sessionId):
     """Fetches specific session metadata by SessionId."""
     try:
@@ -180,22 +391,742 @@ def count_tokens(textInput):
         print(f"Error counting tokens: {e}")
         return 0
 
-def get_embedding_model():
-    """Returns an embedding model."""
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Wraps an embedding model with a bounded, thread-safe LRU cache of
+    query text -> vector. Document embedding is passed through uncached.
+    """
+
+    def __init__(self, baseModel, maxSize=1024):
+        self.baseModel = baseModel
+        self.maxSize = maxSize
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts):
+        return self.baseModel.embed_documents(texts)
+
+    def embed_query(self, text):
+        with self.lock:
+            if text in self.cache:
+                self.cache.move_to_end(text)
+                self.hits += 1
+                return list(self.cache[text])
+            self.misses += 1
+
+        vector = self.baseModel.embed_query(text)
+
+        with self.lock:
+            self.cache[text] = vector
+            self.cache.move_to_end(text)
+            while len(self.cache) > self.maxSize:
+                self.cache.popitem(last=False)
+        return list(vector)
+
+    def stats(self):
+        """Returns hit/miss counters and the hit rate of the query cache."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "Hits": self.hits,
+                "Misses": self.misses,
+                "Size": len(self.cache),
+                "HitRate": self.hits / lookups if lookups else 0.0
+            }
+
+def get_embedding_model(cacheSize=1024):
+    """Returns an embedding model with an LRU cache in front of embed_query."""
     try:
-        return HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+        baseModel = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+        return CachedQueryEmbeddings(baseModel, maxSize=cacheSize)
     except Exception as e:
         print(f"Error getting embedding model: {e}")
         return None
 
-def get_gemini_llm(apiKey,model,temperature):
-    """Returns a Gemini LLM instance."""
+class ResponseCache(BaseCache):
+    """
+    Persistent LLM response cache in a local SQLite file.
+    Exact entries are keyed by a hash of the model settings (model, temperature)
+    and the full prompt. Semantic entries store question vectors per scope
+    (folder + index version) so similar questions can reuse an earlier answer.
+    Entries expire after ttlSeconds; the least recently used are evicted
+    beyond maxEntries.
+    """
+
+    def __init__(self, dbPath, ttlSeconds=86400, maxEntries=5000):
+        self.ttlSeconds = ttlSeconds
+        self.maxEntries = maxEntries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(dbPath, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache "
+                "(key TEXT PRIMARY KEY, value TEXT, created_at REAL, last_access REAL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS semantic_cache "
+                "(id INTEGER PRIMARY KEY AUTOINCREMENT, scope TEXT, question TEXT, "
+                "vector BLOB, answer TEXT, created_at REAL, last_access REAL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS semantic_scope ON semantic_cache (scope)")
+
+    @staticmethod
+    def make_key(prompt, llmString):
+        return hashlib.sha256(f"{llmString}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def evict(self, tableName):
+        """Drops expired rows, then the least recently used rows above maxEntries."""
+        self.connection.execute(f"DELETE FROM {tableName} WHERE created_at < ?", (time.time() - self.ttlSeconds,))
+        self.connection.execute(
+            f"DELETE FROM {tableName} WHERE rowid IN (SELECT rowid FROM {tableName} "
+            f"ORDER BY last_access DESC LIMIT -1 OFFSET ?)", (self.maxEntries,)
+        )
+
+    def lookup(self, prompt, llm_string):
+        try:
+            cacheKey = self.make_key(prompt, llm_string)
+            with self.lock, self.connection:
+                row = self.connection.execute(
+                    "SELECT value, created_at FROM llm_cache WHERE key = ?", (cacheKey,)
+                ).fetchone()
+                if row is None or row[1] < time.time() - self.ttlSeconds:
+                    return None
+                self.connection.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), cacheKey))
+            return [loads(generation) for generation in json.loads(row[0])]
+        except Exception as e:
+            print(f"Error reading response cache: {e}")
+            return None
+
+    def update(self, prompt, llm_string, return_val):
+        try:
+            cacheKey = self.make_key(prompt, llm_string)
+            value = json.dumps([dumps(generation) for generation in return_val])
+            now = time.time()
+            with self.lock, self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+                    (cacheKey, value, now, now)
+                )
+                self.evict("llm_cache")
+        except Exception as e:
+            print(f"Error writing response cache: {e}")
+
+    def clear(self, **kwargs):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM llm_cache")
+            self.connection.execute("DELETE FROM semantic_cache")
+
+    def lookup_similar(self, scope, queryVector, threshold):
+        """Returns the cached answer of the most similar question in scope, or None."""
+        try:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT id, vector, answer FROM semantic_cache WHERE scope = ? AND created_at >= ?",
+                    (scope, time.time() - self.ttlSeconds)
+                ).fetchall()
+            if not rows:
+                return None
+
+            queryVector = np.asarray(queryVector, dtype=np.float32)
+            queryVector = queryVector / (np.linalg.norm(queryVector) or 1.0)
+            storedVectors = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+            similarities = storedVectors @ queryVector
+            bestIndex = int(np.argmax(similarities))
+            if similarities[bestIndex] < threshold:
+                return None
+
+            with self.lock, self.connection:
+                self.connection.execute("UPDATE semantic_cache SET last_access = ? WHERE id = ?", (time.time(), rows[bestIndex][0]))
+            return rows[bestIndex][2]
+        except Exception as e:
+            print(f"Error reading semantic cache: {e}")
+            return None
+
+    def store_similar(self, scope, question, queryVector, answer):
+        """Stores a question vector and its answer for later similarity lookups."""
+        try:
+            queryVector = np.asarray(queryVector, dtype=np.float32)
+            queryVector = queryVector / (np.linalg.norm(queryVector) or 1.0)
+            now = time.time()
+            with self.lock, self.connection:
+                self.connection.execute(
+                    "INSERT INTO semantic_cache (scope, question, vector, answer, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (scope, question, queryVector.tobytes(), answer, now, now)
+                )
+                self.evict("semantic_cache")
+        except Exception as e:
+            print(f"Error writing semantic cache: {e}")
+
+RESPONSE_CACHE = None
+RESPONSE_CACHE_LOCK = threading.Lock()
+
+def get_response_cache(appConfig):
+    """Returns the process-wide response cache, or None when caching is disabled."""
+    global RESPONSE_CACHE
+    try:
+        if not appConfig["LlmCacheEnabled"]:
+            return None
+        with RESPONSE_CACHE_LOCK:
+            if RESPONSE_CACHE is None:
+                RESPONSE_CACHE = ResponseCache(
+                    appConfig["LlmCachePath"],
+                    ttlSeconds=appConfig["LlmCacheTtlSeconds"],
+                    maxEntries=appConfig["LlmCacheMaxEntries"]
+                )
+            return RESPONSE_CACHE
+    except Exception as e:
+        print(f"Error opening response cache: {e}")
+        return None
+
+def get_semantic_cache_scope(dbRecord, webSearchEnabled):
+    """Semantic cache entries are only shared within one folder, index version and web setting."""
+    return f"{dbRecord['_id']}|{dbRecord.get('VectorPath', '')}|{dbRecord.get('CreatedAt', '')}|web={webSearchEnabled}"
+
+def used_retrieval_tools(result):
+    """True when the agent grounded its answer with at least one tool call."""
+    return any(step[0].tool in ("document_search", "web_search") for step in result.get("intermediate_steps", []))
+
+def get_gemini_llm(apiKey,model,temperature,responseCache=None,timeout=None,maxRetries=None,apiEndpoint=None):
+    """
+    Returns a Gemini LLM instance, optionally backed by a response cache.
+    apiEndpoint points the client at another host (e.g. a local fake model server).
+    """
     try:
-        return ChatGoogleGenerativeAI(model=model, google_api_key=apiKey, temperature=temperature)
+        llmKwargs = {"model": model, "google_api_key": apiKey, "temperature": temperature, "cache": responseCache}
+        if timeout is not None:
+            llmKwargs["timeout"] = timeout
+        if maxRetries is not None:
+            llmKwargs["max_retries"] = maxRetries
+        if apiEndpoint:
+            llmKwargs["base_url"] = apiEndpoint
+        return ChatGoogleGenerativeAI(**llmKwargs)
     except Exception as e:
         print(f"Error getting Gemini LLM: {e}")
         return None
 
+# Local fake backends (offline load testing)
+
+def simulated_latency(appConfig, seedText):
+    """
+    Returns a deterministic latency in seconds for the given request text.
+    Seeding per request keeps results reproducible even when calls run concurrently.
+    """
+    rng = random.Random(f"{appConfig['FakeSeed']}:{seedText}")
+    mean = appConfig["FakeLatencyMeanSeconds"]
+    std = appConfig["FakeLatencyStdSeconds"]
+    if appConfig["FakeLatencyDistribution"] == "fixed" or mean <= 0:
+        return max(0.0, mean)
+    if appConfig["FakeLatencyDistribution"] == "lognormal":
+        sigma = np.sqrt(np.log(1 + (std / mean) ** 2))
+        return rng.lognormvariate(np.log(mean) - sigma ** 2 / 2, sigma)
+    return max(0.0, rng.gauss(mean, std))
+
+
+def load_fake_llm_script(scriptPath):
+    """
+    Loads scripted rules for the fake LLM: a JSON list of
+    {"match": regex, "answer": text} and/or {"match": regex, "tools": [{"name": ..., "query": ...}]}.
+    """
+    try:
+        if not scriptPath:
+            return []
+        with open(scriptPath, "r", encoding="utf-8") as scriptFile:
+            return json.load(scriptFile)
+    except Exception as e:
+        print(f"Error loading fake LLM script: {e}")
+        return []
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for Gemini. Emits scripted or rule-based tool calls
+    and answers after a simulated latency, so chat_loop and the agent can be
+    benchmarked offline. Default rules: call document_search (plus web_search
+    for comparison questions) for a new question, then answer from tool output.
+    """
+
+    appConfig: dict
+    scriptRules: list = []
+
+    @property
+    def _llm_type(self):
+        return "fake-chat-model"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        promptText = "\n".join(str(msg.content) for msg in messages)
+        time.sleep(simulated_latency(self.appConfig, promptText))
+
+        toolNames = [t["function"]["name"] for t in kwargs.get("tools", [])]
+        lastHuman = max((i for i, msg in enumerate(messages) if isinstance(msg, HumanMessage)), default=-1)
+        question = str(messages[lastHuman].content) if lastHuman >= 0 else promptText
+        toolOutputs = [str(msg.content) for msg in messages[lastHuman + 1:] if isinstance(msg, ToolMessage)]
+
+        message = self.respond(question, toolNames, toolOutputs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def respond(self, question, toolNames, toolOutputs):
+        """Applies scripted rules first, then the default rules."""
+        for rule in self.scriptRules:
+            if not re.search(rule.get("match", ""), question, re.IGNORECASE):
+                continue
+            if rule.get("tools") and toolNames and not toolOutputs:
+                return self.tool_call_message([(t["name"], t.get("query", question)) for t in rule["tools"]])
+            if "answer" in rule:
+                return AIMessage(content=rule["answer"])
+
+        if toolNames and not toolOutputs:
+            calls = [("document_search", question)]
+            if "web_search" in toolNames and re.search(r"\b(vs|versus|compare|difference)\b", question, re.IGNORECASE):
+                calls.append(("web_search", question))
+            return self.tool_call_message([call for call in calls if call[0] in toolNames])
+
+        if toolOutputs:
+            return AIMessage(content=f"Based on the retrieved information: {toolOutputs[0][:300]}\nSource: Fake Backend")
+        return AIMessage(content=f"[fake answer] {question[:200]}")
+
+    @staticmethod
+    def tool_call_message(calls):
+        toolCalls = [
+            {"name": name, "args": {"query": query}, "id": f"call_{i}_{hashlib.md5(query.encode('utf-8')).hexdigest()[:8]}"}
+            for i, (name, query) in enumerate(calls)
+        ]
+        return AIMessage(content="", tool_calls=toolCalls)
+
+
+class FakeSerpApiWrapper:
+    """Returns canned, SerpAPI-shaped results after a simulated latency."""
+
+    def __init__(self, appConfig):
+        self.appConfig = appConfig
+
+    def results(self, query):
+        time.sleep(simulated_latency(self.appConfig, f"search:{query}"))
+        slug = re.sub(r"[^a-z0-9]+", "-", query.lower()).strip("-")[:60]
+        return {
+            "answer_box": {"snippet": f"Canned answer for '{query}'."},
+            "organic_results": [
+                {
+                    "title": f"Result {i} for {query}",
+                    "snippet": f"Canned snippet {i} describing {query}.",
+                    "link": f"https://example.com/{slug}/{i}"
+                }
+                for i in range(1, 4)
+            ]
+        }
+
+    def run(self, query):
+        return self.results(query)["answer_box"]["snippet"]
+
+
+class SerpApiHttpClient:
+    """
+    Minimal SerpAPI client with a socket timeout on every request (the serpapi
+    library waits up to 60000 seconds). Uses the same search parameters as
+    SerpAPIWrapper; endpoint defaults to https://serpapi.com and can point at a
+    local fake SerpAPI HTTP server.
+    """
+
+    def __init__(self, endpoint, apiKey, timeoutSeconds):
+        self.endpoint = endpoint.rstrip("/")
+        self.apiKey = apiKey or ""
+        self.timeoutSeconds = timeoutSeconds
+
+    def results(self, query):
+        queryString = urllib.parse.urlencode({
+            "engine": "google", "google_domain": "google.com", "gl": "us", "hl": "en",
+            "q": query, "api_key": self.apiKey, "output": "json"
+        })
+        with urllib.request.urlopen(f"{self.endpoint}/search?{queryString}", timeout=self.timeoutSeconds) as httpResponse:
+            return json.loads(httpResponse.read().decode("utf-8"))
+
+    def run(self, query):
+        return SerpAPIWrapper._process_response(self.results(query))
+
+
+# Process-level search client registry: one client per backend/API key
+SEARCH_CLIENTS = {}
+SEARCH_CLIENTS_LOCK = threading.Lock()
+
+def get_search_client(appConfig):
+    """Returns the shared web search client selected by SearchBackend, or None without a SerpAPI key."""
+    apiKey = appConfig.get("SerpApiKey")
+    if appConfig["SearchBackend"] != "fake" and not apiKey and not appConfig["SerpApiEndpoint"]:
+        return None
+    with SEARCH_CLIENTS_LOCK:
+        clientKey = (appConfig["SearchBackend"], apiKey, appConfig["SerpApiEndpoint"])
+        if clientKey not in SEARCH_CLIENTS:
+            if appConfig["SearchBackend"] == "fake":
+                SEARCH_CLIENTS[clientKey] = FakeSerpApiWrapper(appConfig)
+            else:
+                SEARCH_CLIENTS[clientKey] = SerpApiHttpClient(
+                    appConfig["SerpApiEndpoint"] or "https://serpapi.com", apiKey, appConfig["WebSearchDeadlineSeconds"]
+                )
+        return SEARCH_CLIENTS[clientKey]
+
+
+class WebSearchCache:
+    """
+    Persistent cache of raw web search results in a local SQLite file, keyed by
+    the normalized final query (including the appended product context).
+    Empty results are cached too, for the shorter negativeTtlSeconds.
+    """
+
+    def __init__(self, dbPath, ttlSeconds=21600, negativeTtlSeconds=1800, maxEntries=5000):
+        self.ttlSeconds = ttlSeconds
+        self.negativeTtlSeconds = negativeTtlSeconds
+        self.maxEntries = maxEntries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(dbPath, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS web_search_cache "
+                "(key TEXT PRIMARY KEY, query TEXT, results TEXT, is_empty INTEGER, created_at REAL, last_access REAL)"
+            )
+
+    @staticmethod
+    def normalize(query):
+        return " ".join(query.lower().split())
+
+    METADATA_FIELDS = {"search_metadata", "search_parameters", "search_information", "serpapi_pagination", "pagination"}
+
+    @staticmethod
+    def is_api_error(rawResults):
+        """
+        True for failed searches (quota, invalid key, backend errors). SerpAPI also
+        reports "no results" under "error", but with a successful search status.
+        """
+        if "error" not in rawResults:
+            return False
+        searchStatus = (rawResults.get("search_metadata") or {}).get("status")
+        return searchStatus != "Success" and "hasn't returned any results" not in str(rawResults["error"])
+
+    @staticmethod
+    def is_empty(rawResults):
+        """True for "no results" responses and responses without any result section."""
+        if "error" in rawResults:
+            return True
+        return not any(value for field, value in rawResults.items() if field not in WebSearchCache.METADATA_FIELDS)
+
+    def lookup(self, query):
+        """Returns the cached raw results of a query, or None when absent or expired."""
+        try:
+            normalizedQuery = self.normalize(query)
+            cacheKey = hashlib.sha256(normalizedQuery.encode("utf-8")).hexdigest()
+            with self.lock, self.connection:
+                row = self.connection.execute(
+                    "SELECT results, is_empty, created_at FROM web_search_cache WHERE key = ?", (cacheKey,)
+                ).fetchone()
+                if row is None:
+                    return None
+                ttlSeconds = self.negativeTtlSeconds if row[1] else self.ttlSeconds
+                if row[2] < time.time() - ttlSeconds:
+                    return None
+                self.connection.execute("UPDATE web_search_cache SET last_access = ? WHERE key = ?", (time.time(), cacheKey))
+            return json.loads(row[0])
+        except Exception as e:
+            print(f"Error reading web search cache: {e}")
+            return None
+
+    def update(self, query, rawResults):
+        # Failed searches are not results: they are retried instead of cached
+        if self.is_api_error(rawResults):
+            return
+        try:
+            normalizedQuery = self.normalize(query)
+            cacheKey = hashlib.sha256(normalizedQuery.encode("utf-8")).hexdigest()
+            now = time.time()
+            with self.lock, self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO web_search_cache (key, query, results, is_empty, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (cacheKey, normalizedQuery, json.dumps(rawResults, default=str), int(self.is_empty(rawResults)), now, now)
+                )
+                self.connection.execute(
+                    "DELETE FROM web_search_cache WHERE created_at < ?", (now - max(self.ttlSeconds, self.negativeTtlSeconds),)
+                )
+                self.connection.execute(
+                    "DELETE FROM web_search_cache WHERE rowid IN (SELECT rowid FROM web_search_cache "
+                    "ORDER BY last_access DESC LIMIT -1 OFFSET ?)", (self.maxEntries,)
+                )
+        except Exception as e:
+            print(f"Error writing web search cache: {e}")
+
+WEB_SEARCH_CACHE = None
+WEB_SEARCH_CACHE_LOCK = threading.Lock()
+
+def get_web_search_cache(appConfig):
+    """Returns the process-wide web search cache, or None when it is disabled."""
+    global WEB_SEARCH_CACHE
+    try:
+        if not appConfig["WebSearchCacheEnabled"]:
+            return None
+        with WEB_SEARCH_CACHE_LOCK:
+            if WEB_SEARCH_CACHE is None:
+                WEB_SEARCH_CACHE = WebSearchCache(
+                    appConfig["WebSearchCachePath"],
+                    ttlSeconds=appConfig["WebSearchCacheTtlSeconds"],
+                    negativeTtlSeconds=appConfig["WebSearchNegativeTtlSeconds"],
+                    maxEntries=appConfig["WebSearchCacheMaxEntries"]
+                )
+            return WEB_SEARCH_CACHE
+    except Exception as e:
+        print(f"Error opening web search cache: {e}")
+        return None
+
+
+# Resilient invocation: deadlines, jittered exponential backoff and optional hedging per LLM request
+
+RETRYABLE_ERROR_MARKERS = (
+    "429", "500", "502", "503", "504", "resourceexhausted", "resource exhausted", "unavailable",
+    "deadline", "timeout", "timed out", "internal", "connection", "temporarily"
+)
+
+class LatencyTracker:
+    """Keeps recent successful call durations and reports a percentile for hedging."""
+
+    def __init__(self, maxSamples=200):
+        self.samples = deque(maxlen=maxSamples)
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, percent, minSamples):
+        """Returns the percentile in seconds, or None until minSamples calls were recorded."""
+        with self.lock:
+            if len(self.samples) < minSamples:
+                return None
+            return float(np.percentile(list(self.samples), percent))
+
+LLM_LATENCY_TRACKER = LatencyTracker()
+
+def is_retryable_error(error):
+    """Transient errors (rate limits, 5xx, timeouts, dropped connections) are retried."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    errorText = f"{type(error).__name__} {error}".lower()
+    return any(marker in errorText for marker in RETRYABLE_ERROR_MARKERS)
+
+def generation_to_chunk(generation):
+    """Turns a complete ChatGeneration into a single stream chunk (tool calls included)."""
+    message = generation.message
+    return ChatGenerationChunk(message=AIMessageChunk(
+        content=message.content,
+        additional_kwargs=message.additional_kwargs,
+        response_metadata=message.response_metadata,
+        usage_metadata=getattr(message, "usage_metadata", None),
+        id=message.id,
+        tool_call_chunks=[
+            {"name": toolCall["name"], "args": json.dumps(toolCall["args"]), "id": toolCall["id"], "index": i}
+            for i, toolCall in enumerate(getattr(message, "tool_calls", None) or [])
+        ]
+    ))
+
+ATTEMPT_DONE = object()
+
+
+class ResilientChatModel(BaseChatModel):
+    """Wraps the shared chat model with a per-request deadline, jittered retries, hedging and exact-match caching."""
+
+    innerModel: BaseChatModel
+    appConfig: dict
+    responseCache: BaseCache | None = None
+    # Provider cachedContents name; requests then send no tools (Gemini rejects both together)
+    cachedContent: str | None = None
+
+    @property
+    def _llm_type(self):
+        return self.innerModel._llm_type
+
+    @property
+    def _identifying_params(self):
+        return self.innerModel._identifying_params
+
+    def bind_tools(self, tools, **kwargs):
+        # The tool schemas are already part of the cached content
+        if self.cachedContent:
+            return self.bind()
+        # Same request arguments as the wrapped model would bind
+        return self.bind(**self.innerModel.bind_tools(tools, **kwargs).kwargs)
+
+    def start_attempt(self, messages, stop, kwargs, events, isHedge):
+        """Runs one attempt on its own thread; its chunks go to the shared events queue."""
+        attempt = {"Abandoned": threading.Event(), "IsHedge": isHedge}
+        canStream = type(self.innerModel)._stream is not BaseChatModel._stream
+
+        def run_attempt():
+            try:
+                if canStream:
+                    for chunk in self.innerModel._stream(messages, stop=stop, **kwargs):
+                        if attempt["Abandoned"].is_set():
+                            return
+                        events.put((attempt, chunk))
+                else:
+                    result = self.innerModel._generate(messages, stop=stop, **kwargs)
+                    events.put((attempt, generation_to_chunk(result.generations[0])))
+                events.put((attempt, ATTEMPT_DONE))
+            except Exception as e:
+                events.put((attempt, e))
+
+        threading.Thread(target=run_attempt, daemon=True, name="llm-attempt").start()
+        return attempt
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.cachedContent:
+            kwargs = {**kwargs, "cached_content": self.cachedContent}
+        if self.responseCache is None:
+            yield from self.stream_with_resilience(messages, stop, run_manager, **kwargs)
+            return
+
+        # Same key as BaseChatModel's own cache: serialized prompt + model settings (tools included)
+        cachePrompt = dumps(messages)
+        llmString = self._get_llm_string(stop=stop, **kwargs)
+        cachedGenerations = self.responseCache.lookup(cachePrompt, llmString)
+        if cachedGenerations:
+            yield generation_to_chunk(cachedGenerations[0])
+            return
+
+        streamedChunks = []
+        for chunk in self.stream_with_resilience(messages, stop, run_manager, **kwargs):
+            streamedChunks.append(chunk)
+            yield chunk
+        if streamedChunks:
+            self.responseCache.update(cachePrompt, llmString, generate_from_stream(iter(streamedChunks)).generations)
+
+    def stream_with_resilience(self, messages, stop=None, run_manager=None, **kwargs):
+        appConfig = self.appConfig
+        turnDeadline = (getattr(run_manager, "metadata", None) or {}).get("TurnDeadline")
+        deadline = turnDeadline or time.monotonic() + appConfig["LlmTurnDeadlineSeconds"]
+        lastError = None
+
+        for retry in range(appConfig["LlmMaxRetries"] + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            attemptTimeout = min(remaining, appConfig["LlmAttemptTimeoutSeconds"])
+            startedAt = time.monotonic()
+            events = queue.Queue()
+            attempts = [self.start_attempt(messages, stop, kwargs, events, False)]
+            hedgeDelay = LLM_LATENCY_TRACKER.percentile(95, appConfig["LlmHedgeMinSamples"]) if appConfig["LlmHedgingEnabled"] else None
+
+            # Wait for the first chunk of any attempt; a hedge starts once the p95 latency has passed
+            winner, firstItem, attemptError, failedCount = None, None, None, 0
+            while winner is None:
+                elapsed = time.monotonic() - startedAt
+                if elapsed >= attemptTimeout:
+                    attemptError = TimeoutError(f"LLM call timed out after {attemptTimeout:.1f} seconds")
+                    break
+                waitFor = attemptTimeout - elapsed
+                if hedgeDelay is not None:
+                    waitFor = max(0.0, min(waitFor, hedgeDelay - elapsed))
+                try:
+                    attempt, item = events.get(timeout=waitFor)
+                except queue.Empty:
+                    if hedgeDelay is not None and time.monotonic() - startedAt >= hedgeDelay:
+                        attempts.append(self.start_attempt(messages, stop, kwargs, events, True))
+                        hedgeDelay = None
+                    continue
+                if isinstance(item, Exception):
+                    attemptError = item
+                    failedCount += 1
+                    if failedCount == len(attempts) and hedgeDelay is None:
+                        break
+                    continue
+                winner, firstItem = attempt, item
+
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt["Abandoned"].set()
+
+            if winner is not None:
+                LLM_LATENCY_TRACKER.record(time.monotonic() - startedAt)
+                yield from self.relay_attempt(winner, firstItem, events, deadline, {"attempts": retry + 1, "hedged": winner["IsHedge"]})
+                return
+
+            lastError = attemptError
+            if lastError is None or not is_retryable_error(lastError):
+                break
+            if retry < appConfig["LlmMaxRetries"]:
+                backoff = random.uniform(0, appConfig["LlmBackoffBaseSeconds"] * (2 ** retry))
+                if time.monotonic() + backoff >= deadline:
+                    break
+                time.sleep(backoff)
+
+        if lastError is not None and not is_retryable_error(lastError):
+            raise lastError
+        raise TimeoutError(f"No response within {appConfig['LlmTurnDeadlineSeconds']:.0f} seconds ({lastError})")
+
+    def relay_attempt(self, winner, firstItem, events, deadline, resilienceInfo):
+        """Passes on the chunks of the winning attempt until it finishes or the deadline passes."""
+        item = firstItem
+        isFirst = True
+        while item is not ATTEMPT_DONE:
+            if isinstance(item, Exception):
+                raise item
+            if isFirst:
+                item.message.response_metadata = {**item.message.response_metadata, "resilience": resilienceInfo}
+                isFirst = False
+            yield item
+            while True:
+                try:
+                    attempt, item = events.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    winner["Abandoned"].set()
+                    raise TimeoutError("LLM response did not finish before the turn deadline")
+                if attempt is winner:
+                    break
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return generate_from_stream(self._stream(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+
+# Process-level client registry: one Gemini client (and HTTP pool) per model/temperature
+LLM_CLIENTS = {}
+LLM_CLIENTS_LOCK = threading.Lock()
+
+def get_shared_llm(appConfig, model=None, temperature=None, useResponseCache=True):
+    """
+    Returns the shared Gemini client for a model/temperature pair, creating it on first use.
+    useResponseCache=False returns a wrapper around the same client that never answers from the cache.
+    """
+    try:
+        model = model or appConfig["LlmModel"] or "gemini-2.5-flash"
+        temperature = appConfig["LlmTemperature"] if temperature is None else temperature
+        with LLM_CLIENTS_LOCK:
+            clientKey = (model, temperature)
+            if clientKey not in LLM_CLIENTS:
+                if appConfig["LlmBackend"] == "fake":
+                    llm = FakeChatModel(
+                        appConfig=appConfig,
+                        scriptRules=load_fake_llm_script(appConfig["FakeLlmScriptPath"])
+                    )
+                else:
+                    # Retries are handled per request by ResilientChatModel, not inside the client
+                    llm = get_gemini_llm(appConfig["GoogleApiKey"], model=model, temperature=temperature,
+                                         timeout=appConfig["LlmAttemptTimeoutSeconds"], maxRetries=0,
+                                         apiEndpoint=appConfig["LlmApiEndpoint"])
+                if llm is None:
+                    return None
+                # The fake backend never answers from the cache, so benchmark runs stay reproducible
+                responseCache = get_response_cache(appConfig) if appConfig["LlmBackend"] != "fake" else None
+                LLM_CLIENTS[clientKey] = ResilientChatModel(innerModel=llm, appConfig=appConfig, responseCache=responseCache)
+            if not useResponseCache:
+                uncachedKey = (model, temperature, "uncached")
+                if uncachedKey not in LLM_CLIENTS:
+                    LLM_CLIENTS[uncachedKey] = LLM_CLIENTS[clientKey].model_copy(update={"responseCache": None})
+                return LLM_CLIENTS[uncachedKey]
+            return LLM_CLIENTS[clientKey]
+    except Exception as e:
+        print(f"Error getting shared LLM: {e}")
+        return None
+
 def load_documents_from_folder(folderPath):
     """Loads documents from a folder using various loaders."""
     try:
@@ -230,6 +1161,80 @@ def split_documents(documents, appConfig):
         print(f"Error splitting documents: {e}")
         return []
 
+def split_markdown_sections(document, appConfig):
+    """Splits a markdown document along its headers; oversized sections are split further."""
+    try:
+        headerSplitter = MarkdownHeaderTextSplitter(
+            headers_to_split_on=[("#", "Header1"), ("##", "Header2"), ("###", "Header3")],
+            strip_headers=False
+        )
+        sizeSplitter = RecursiveCharacterTextSplitter(
+            chunk_size=appConfig["ChunkSize"], 
+            chunk_overlap=appConfig["ChunkOverlap"]
+        )
+        sections = []
+        for section in headerSplitter.split_text(document.page_content):
+            section.metadata = {**document.metadata, **section.metadata}
+            if len(section.page_content) > appConfig["ChunkSize"]:
+                sections.extend(sizeSplitter.split_documents([section]))
+            else:
+                sections.append(section)
+        return sections
+    except Exception as e:
+        print(f"Error splitting markdown sections: {e}")
+        return split_documents([document], appConfig)
+
+def split_parent_child_documents(documents, appConfig):
+    """
+    Splits documents into large parent sections and small child chunks.
+    Markdown files are split along their sections; other files use ChunkSize.
+    Only the children get embedded; each child carries the id of its parent.
+    Returns (childChunks, parentStore) where parentStore maps id -> parent data.
+    """
+    try:
+        childSplitter = RecursiveCharacterTextSplitter(
+            chunk_size=appConfig["ChildChunkSize"], 
+            chunk_overlap=appConfig["ChildChunkOverlap"]
+        )
+        parentStore = {}
+        childChunks = []
+        for document in documents:
+            if document.metadata.get("source", "").lower().endswith(".md"):
+                parents = split_markdown_sections(document, appConfig)
+            else:
+                parents = split_documents([document], appConfig)
+
+            for parent in parents:
+                parentId = str(uuid.uuid4())
+                parentStore[parentId] = {"content": parent.page_content, "metadata": parent.metadata}
+                for child in childSplitter.split_documents([parent]):
+                    child.metadata["parent_id"] = parentId
+                    childChunks.append(child)
+        return childChunks, parentStore
+    except Exception as e:
+        print(f"Error creating parent/child chunks: {e}")
+        return [], {}
+
+def save_parent_store(parentStore, vectorPath):
+    """Saves parent sections as a compressed JSON file next to the chunk index."""
+    try:
+        with gzip.open(os.path.join(vectorPath, "parents.json.gz"), "wt", encoding="utf-8") as parentFile:
+            json.dump(parentStore, parentFile)
+    except Exception as e:
+        print(f"Error saving parent store: {e}")
+
+def load_parent_store(vectorPath):
+    """Loads the parent section store, or None for stores built without one."""
+    try:
+        parentPath = os.path.join(vectorPath, "parents.json.gz")
+        if not os.path.exists(parentPath):
+            return None
+        with gzip.open(parentPath, "rt", encoding="utf-8") as parentFile:
+            return json.load(parentFile)
+    except Exception as e:
+        print(f"Error loading parent store: {e}")
+        return None
+
 def create_vector_store(docChunks, embeddingModel):
     """Creates a FAISS vector store from document chunks."""
     try:
@@ -238,6 +1243,40 @@ def create_vector_store(docChunks, embeddingModel):
         print(f"Error creating vector store: {e}")
         return None
 
+def build_document_index(vectorStore, embeddingModel):
+    """
+    Builds a document-level FAISS index with one centroid vector per source file.
+    Each entry keeps the positions of its chunks in the chunk index so the
+    second retrieval stage can search inside the selected files only.
+    """
+    try:
+        chunkPositions = {}
+        for position, docstoreId in vectorStore.index_to_docstore_id.items():
+            chunkDoc = vectorStore.docstore.search(docstoreId)
+            source = chunkDoc.metadata.get("source", "unknown")
+            chunkPositions.setdefault(source, []).append(position)
+
+        textEmbeddings = []
+        metadatas = []
+        for source, positions in chunkPositions.items():
+            chunkVectors = np.vstack([vectorStore.index.reconstruct(int(pos)) for pos in positions])
+            centroid = chunkVectors.mean(axis=0)
+            centroid = centroid / (np.linalg.norm(centroid) or 1.0)
+            textEmbeddings.append((os.path.basename(source), centroid.tolist()))
+            metadatas.append({"source": source, "chunk_positions": positions})
+
+        return FAISS.from_embeddings(textEmbeddings, embeddingModel, metadatas=metadatas)
+    except Exception as e:
+        print(f"Error building document index: {e}")
+        return None
+
+def save_document_index(documentIndex, vectorPath):
+    """Saves the document-level index next to the chunk index."""
+    try:
+        documentIndex.save_local(os.path.join(vectorPath, "documents"))
+    except Exception as e:
+        print(f"Error saving document index: {e}")
+
 def save_vector_store(vectorStore, appConfig):
     """Saves the vector store locally and returns the path."""
     try:
@@ -276,12 +1315,23 @@ def process_static_directory(mongoDatabase, embeddingModel, appConfig):
                 if not documents: 
                     continue
                     
-                docChunks = split_documents(documents, appConfig)
+                parentStore = None
+                if appConfig["ParentDocumentRetrieval"]:
+                    docChunks, parentStore = split_parent_child_documents(documents, appConfig)
+                else:
+                    docChunks = split_documents(documents, appConfig)
                 vectorStore = create_vector_store(docChunks, embeddingModel)
                 
                 if vectorStore:
                     vectorSavePath = save_vector_store(vectorStore, appConfig)
-                    totalTokens = count_tokens(" ".join([d.page_content for d in docChunks]))
+                    documentIndex = build_document_index(vectorStore, embeddingModel)
+                    if vectorSavePath and documentIndex:
+                        save_document_index(documentIndex, vectorSavePath)
+                    if vectorSavePath and parentStore:
+                        save_parent_store(parentStore, vectorSavePath)
+                        totalTokens = count_tokens(" ".join([p["content"] for p in parentStore.values()]))
+                    else:
+                        totalTokens = count_tokens(" ".join([d.page_content for d in docChunks]))
                     
                     insert_folder_record(
                         mongoDatabase, 
@@ -309,6 +1359,164 @@ def load_vector_store_local(vectorPath, embeddingModel):
         print(f"Error loading vector store: {e}")
         return None
 
+def load_document_index(vectorPath, embeddingModel):
+    """Loads the document-level index, or None for stores built without one."""
+    try:
+        documentPath = os.path.join(vectorPath, "documents")
+        if not os.path.exists(documentPath):
+            return None
+        return FAISS.load_local(documentPath, embeddingModel, allow_dangerous_deserialization=True)
+    except Exception as e:
+        print(f"Error loading document index: {e}")
+        return None
+
+def load_relevance_thresholds(vectorPath):
+    """Loads calibrated relevance-gate thresholds for a folder, or {} when not calibrated."""
+    try:
+        thresholdPath = os.path.join(vectorPath, "relevance_thresholds.json")
+        if not os.path.exists(thresholdPath):
+            return {}
+        with open(thresholdPath, "r", encoding="utf-8") as thresholdFile:
+            return json.load(thresholdFile)
+    except Exception as e:
+        print(f"Error loading relevance thresholds: {e}")
+        return {}
+
+class WebSupplementIndex:
+    """
+    Per-folder FAISS index of web results that were used in answers, stored in
+    <vectorPath>/web_supplement. Entries carry an ExpiresAt timestamp: expired
+    entries are never returned and are deleted on the next ingest.
+    """
+
+    def __init__(self, vectorPath, embeddingModel):
+        self.path = os.path.join(vectorPath, "web_supplement")
+        self.embeddingModel = embeddingModel
+        self.lock = threading.Lock()
+        self.store = None
+        try:
+            if os.path.exists(self.path):
+                self.store = FAISS.load_local(self.path, embeddingModel, allow_dangerous_deserialization=True)
+        except Exception as e:
+            print(f"Error loading web supplement index: {e}")
+
+    def search(self, query, appConfig):
+        """Returns unexpired (document, score) pairs above the retrieval score threshold."""
+        try:
+            with self.lock:
+                if self.store is None:
+                    return []
+                # Expired entries are filtered inside the search (over a larger candidate set),
+                # so they cannot take the top-k slots of valid ones
+                now = time.time()
+                scoredDocs = self.store.similarity_search_with_relevance_scores(
+                    query,
+                    k=appConfig["WebSupplementK"],
+                    filter=lambda metadata: metadata.get("ExpiresAt", 0) > now,
+                    fetch_k=max(20, 10 * appConfig["WebSupplementK"])
+                )
+            return [(doc, score) for doc, score in scoredDocs if score >= appConfig["RetrieverScoreThreshold"]]
+        except Exception as e:
+            print(f"Error searching web supplement index: {e}")
+            return []
+
+    def add(self, webResults, appConfig):
+        """Chunks, embeds and stores web results ({"Title", "Snippet", "Link", "Query"}); saves the index."""
+        try:
+            now = time.time()
+            documents = [
+                Document(
+                    page_content=f"{result['Title']}\n{result['Snippet']}".strip(),
+                    metadata={
+                        "source": f"Web Search - {result['Link']}" if result["Link"] else "Web Search",
+                        "origin": "web",
+                        "link": result["Link"],
+                        "query": result["Query"],
+                        "FetchedAt": now,
+                        "ExpiresAt": now + appConfig["WebIngestTtlSeconds"]
+                    }
+                )
+                for result in webResults
+            ]
+            docChunks = split_documents(documents, appConfig)
+            with self.lock:
+                staleIds = []
+                if self.store is not None:
+                    for docId in self.store.index_to_docstore_id.values():
+                        storedDoc = self.store.docstore.search(docId)
+                        if isinstance(storedDoc, Document) and storedDoc.metadata.get("ExpiresAt", 0) <= now:
+                            staleIds.append(docId)
+                newChunks, newIds = [], []
+                for chunk in docChunks:
+                    chunkId = hashlib.sha256(f"{chunk.metadata['link']}\n{chunk.page_content}".encode("utf-8")).hexdigest()
+                    if chunkId in newIds:
+                        continue
+                    # A re-used result gets a fresh expiry
+                    if self.store is not None and isinstance(self.store.docstore.search(chunkId), Document):
+                        if chunkId not in staleIds:
+                            staleIds.append(chunkId)
+                    newChunks.append(chunk)
+                    newIds.append(chunkId)
+                if self.store is not None and staleIds:
+                    self.store.delete(staleIds)
+                if newChunks:
+                    if self.store is None:
+                        self.store = FAISS.from_documents(newChunks, self.embeddingModel, ids=newIds)
+                    else:
+                        self.store.add_documents(newChunks, ids=newIds)
+                if newChunks or staleIds:
+                    self.store.save_local(self.path)
+            return len(newChunks)
+        except Exception as e:
+            print(f"Error adding to web supplement index: {e}")
+            return 0
+
+
+def load_folder_indexes(vectorPath, embeddingModel):
+    """Loads the optional companion indexes stored next to a folder's chunk index."""
+    return {
+        "DocumentIndex": load_document_index(vectorPath, embeddingModel),
+        "ParentStore": load_parent_store(vectorPath),
+        "RelevanceThresholds": load_relevance_thresholds(vectorPath),
+        "WebSupplement": WebSupplementIndex(vectorPath, embeddingModel),
+        "VectorPath": vectorPath
+    }
+
+def compute_folder_centroid(vectorStore):
+    """Returns the normalized mean of all chunk vectors of a folder, or None."""
+    try:
+        chunkVectors = vectorStore.index.reconstruct_n(0, vectorStore.index.ntotal)
+        centroid = np.asarray(chunkVectors, dtype=np.float32).mean(axis=0)
+        return centroid / (np.linalg.norm(centroid) or 1.0)
+    except Exception as e:
+        print(f"Error computing folder centroid: {e}")
+        return None
+
+# Loaded folders shared between the warm-up thread and chat sessions, keyed by vector path
+LOADED_FOLDER_CACHE = {}
+LOADED_FOLDER_LOCK = threading.Lock()
+LOADED_FOLDER_LOCKS = {}
+
+def get_loaded_folder(folderRecord, embeddingModel):
+    """Returns (vectorStore, folderIndexes) for a folder, loading it from disk only once."""
+    try:
+        vectorPath = folderRecord['VectorPath']
+        with LOADED_FOLDER_LOCK:
+            folderLock = LOADED_FOLDER_LOCKS.setdefault(vectorPath, threading.Lock())
+        # Per-folder lock: a folder being warmed up does not block loading another one
+        with folderLock:
+            if vectorPath not in LOADED_FOLDER_CACHE:
+                vectorStore = load_vector_store_local(vectorPath, embeddingModel)
+                if vectorStore is None:
+                    return None, None
+                folderIndexes = load_folder_indexes(vectorPath, embeddingModel)
+                folderIndexes["Centroid"] = compute_folder_centroid(vectorStore)
+                LOADED_FOLDER_CACHE[vectorPath] = (vectorStore, folderIndexes)
+            return LOADED_FOLDER_CACHE[vectorPath]
+    except Exception as e:
+        print(f"Error loading folder: {e}")
+        return None, None
+
 class RagSearchInput(BaseModel):
     query: str = Field(..., 
                        description="The specific question or keywords to search for in the local document database.")
@@ -320,6 +1528,90 @@ class WebSearchInput(BaseModel):
 
 # Tool Implementations
 
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency. Opens after failureThreshold
+    consecutive failures; after cooldownSeconds one probe call is let
+    through (half-open) and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failureThreshold=3, cooldownSeconds=60.0):
+        self.failureThreshold = failureThreshold
+        self.cooldownSeconds = cooldownSeconds
+        self.consecutiveFailures = 0
+        self.openedAt = None
+        self.probeInFlight = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """True when a call may go out now."""
+        with self.lock:
+            if self.openedAt is None:
+                return True
+            if self.probeInFlight or time.monotonic() - self.openedAt < self.cooldownSeconds:
+                return False
+            self.probeInFlight = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.consecutiveFailures = 0
+            self.openedAt = None
+            self.probeInFlight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutiveFailures += 1
+            if self.probeInFlight or self.consecutiveFailures >= self.failureThreshold:
+                self.openedAt = time.monotonic()
+            self.probeInFlight = False
+
+    def state(self):
+        with self.lock:
+            if self.openedAt is None:
+                return "closed"
+            return "half-open" if self.probeInFlight else "open"
+
+WEB_SEARCH_BREAKER = None
+WEB_SEARCH_BREAKER_LOCK = threading.Lock()
+WEB_SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="web-search")
+
+def get_web_search_breaker(appConfig):
+    """Returns the process-wide web search circuit breaker."""
+    global WEB_SEARCH_BREAKER
+    with WEB_SEARCH_BREAKER_LOCK:
+        if WEB_SEARCH_BREAKER is None:
+            WEB_SEARCH_BREAKER = CircuitBreaker(
+                appConfig["WebSearchBreakerFailures"], appConfig["WebSearchBreakerCooldownSeconds"]
+            )
+        return WEB_SEARCH_BREAKER
+
+def fetch_web_results(serpApi, contextualQuery, appConfig):
+    """
+    Calls the search API under a strict deadline, guarded by the circuit
+    breaker. Returns the raw results, or None when web search is unavailable.
+    """
+    breaker = get_web_search_breaker(appConfig)
+    if not breaker.allow():
+        return None
+    searchFuture = WEB_SEARCH_EXECUTOR.submit(serpApi.results, contextualQuery)
+    try:
+        rawResults = searchFuture.result(timeout=appConfig["WebSearchDeadlineSeconds"])
+    except Exception as e:
+        searchFuture.cancel()
+        breaker.record_failure()
+        print(f"Error during web search ({breaker.state()}): {str(e) or 'deadline exceeded'}")
+        return None
+    # SerpAPI reports quota, key and backend failures in the body, not as an exception
+    if WebSearchCache.is_api_error(rawResults):
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return rawResults
+
+WEB_SEARCH_UNAVAILABLE = "Web search is temporarily unavailable. Answer from the documents, or tell the user to try again later."
+
+
 def create_web_search_tool(appConfig, enabled=True):
     """Creates the web search tool using SerpAPI."""
     
@@ -335,14 +1627,28 @@ def create_web_search_tool(appConfig, enabled=True):
             if not enabled:
                 return "Web search is disabled for this session. Only document search is available."
             
-            apiKey = appConfig.get("SerpApiKey")
-            if not apiKey:
+            serpApi = get_search_client(appConfig)
+            if serpApi is None:
                 return "Web search disabled (missing SERPAPI_API_KEY)."
             
-            serpApi = SerpAPIWrapper(serpapi_api_key=apiKey)
             # Append context to query to ensure relevance
             contextualQuery = f"{query} Skyscape Buzz App"
-            rawResults = serpApi.results(contextualQuery)
+            searchCache = get_web_search_cache(appConfig)
+            rawResults = searchCache.lookup(contextualQuery) if searchCache else None
+            if rawResults is None:
+                rawResults = fetch_web_results(serpApi, contextualQuery, appConfig)
+                if rawResults is None:
+                    return WEB_SEARCH_UNAVAILABLE
+                if searchCache:
+                    searchCache.update(contextualQuery, rawResults)
+            
+            # Quota or key failures must not look like an empty result to the agent
+            if WebSearchCache.is_api_error(rawResults):
+                print(f"Error during web search: {rawResults['error']}")
+                return WEB_SEARCH_UNAVAILABLE
+            
+            if WebSearchCache.is_empty(rawResults):
+                return "No web results found for this query."
             
             formattedOutput = []
             
@@ -368,10 +1674,11 @@ def create_web_search_tool(appConfig, enabled=True):
                     formattedOutput.append(f"    {snippet}")
                     formattedOutput.append(f"    Link: {link}")
             
+            # Other result types are formatted from the same response instead of a second API call
             if formattedOutput:
                 return "\n".join(formattedOutput)
             else:
-                return serpApi.run(contextualQuery)
+                return SerpAPIWrapper._process_response(rawResults)
                 
         except Exception as e:
             return f"Error during web search: {e}"
@@ -379,8 +1686,419 @@ def create_web_search_tool(appConfig, enabled=True):
     return web_search_tool
 
 
-def create_rag_search_tool(retriever):
-    """Creates the RAG document search tool using the given retriever."""
+def search_within_documents(vectorStore, documentIndex, query, appConfig):
+    """
+    Two-stage retrieval: picks the top documents from the document-level index,
+    then scores only the chunks belonging to those documents.
+    Returns a list of (document, relevance score) tuples.
+    """
+    try:
+        queryVector = np.asarray(vectorStore.embeddings.embed_query(query), dtype=np.float32)
+        topDocuments = documentIndex.similarity_search_by_vector(queryVector.tolist(), k=appConfig["DocumentTopN"])
+
+        positions = np.array(sorted({pos for fileDoc in topDocuments for pos in fileDoc.metadata.get("chunk_positions", [])}), dtype=np.int64)
+        if not len(positions):
+            return []
+
+        # The flat index only visits the listed positions, so the cost follows the selected chunks
+        searchParams = faiss.SearchParameters(sel=faiss.IDSelectorArray(positions))
+        distances, indices = vectorStore.index.search(queryVector.reshape(1, -1), min(appConfig["RetrieverK"], len(positions)), params=searchParams)
+        # Squared L2 from the index, scored with the store's own relevance function
+        # so fixed thresholds mean the same as for a plain similarity search
+        relevanceFn = vectorStore._select_relevance_score_fn()
+
+        scoredDocs = []
+        for distance, pos in zip(distances[0], indices[0]):
+            if pos < 0:
+                continue
+            docstoreId = vectorStore.index_to_docstore_id[int(pos)]
+            scoredDocs.append((vectorStore.docstore.search(docstoreId), float(relevanceFn(float(distance)))))
+        return scoredDocs
+    except Exception as e:
+        print(f"Error in document-level search: {e}")
+        return []
+
+
+def search_with_adaptive_k(vectorStore, query, appConfig, documentIndex=None):
+    """
+    Retrieves up to RetrieverK chunks with relevance scores and trims the list
+    dynamically: chunks below the score threshold are dropped and the list is
+    cut at the first large drop in score relative to the top hit.
+    When a document index is available and the folder has more files than
+    DocumentTopN, only chunks of the best-matching files are searched.
+    Returns a list of (document, score) tuples, best first.
+    """
+    try:
+        maxK = appConfig["RetrieverK"]
+        scoreThreshold = appConfig["RetrieverScoreThreshold"]
+        scoreGap = appConfig["RetrieverScoreGap"]
+
+        if documentIndex is not None and documentIndex.index.ntotal > appConfig["DocumentTopN"]:
+            scoredDocs = search_within_documents(vectorStore, documentIndex, query, appConfig)
+        else:
+            scoredDocs = vectorStore.similarity_search_with_relevance_scores(query, k=maxK)
+        scoredDocs = [(doc, score) for doc, score in scoredDocs if score >= scoreThreshold]
+        if not scoredDocs:
+            return []
+
+        scoredDocs.sort(key=lambda pair: pair[1], reverse=True)
+        # Measured from the top hit, not the previous one, so a slow decline
+        # cannot chain weak hits onto a near-exact match
+        topScore = scoredDocs[0][1]
+        return [(doc, score) for doc, score in scoredDocs if topScore - score <= scoreGap]
+    except Exception as e:
+        print(f"Error in adaptive search: {e}")
+        return []
+
+
+def expand_to_parents(scoredDocs, parentStore):
+    """
+    Replaces matched child chunks with their parent sections, keeping the best
+    score per parent. Chunks without a known parent are returned unchanged.
+    """
+    expandedDocs = []
+    seenParents = set()
+    for doc, score in scoredDocs:
+        parentId = doc.metadata.get("parent_id")
+        if parentId is None or parentId not in parentStore:
+            expandedDocs.append((doc, score))
+            continue
+        if parentId in seenParents:
+            continue
+        seenParents.add(parentId)
+        parent = parentStore[parentId]
+        expandedDocs.append((Document(page_content=parent["content"], metadata=parent["metadata"]), score))
+    return expandedDocs
+
+
+SENTENCE_SPLIT_PATTERN = re.compile(r"(?<=[.!?])\s+|\n+")
+
+def compress_passages(query, docs, embeddingModel, tokenBudget):
+    """
+    Extractive compression: keeps only the sentences most similar to the query,
+    within a token budget shared by all passages. All sentences are embedded in
+    one batch. Returns one compressed text per document, sentences kept in
+    their original order ("" when nothing from that document was selected).
+    """
+    sentencesPerDoc = [
+        [sentence.strip() for sentence in SENTENCE_SPLIT_PATTERN.split(doc.page_content) if sentence.strip()]
+        for doc in docs
+    ]
+    flatSentences = [(docIndex, sentence) for docIndex, sentences in enumerate(sentencesPerDoc) for sentence in sentences]
+    if not flatSentences:
+        return ["" for _ in docs]
+
+    sentenceVectors = np.asarray(embeddingModel.embed_documents([sentence for _, sentence in flatSentences]), dtype=np.float32)
+    sentenceVectors = sentenceVectors / np.maximum(np.linalg.norm(sentenceVectors, axis=1, keepdims=True), 1e-12)
+    queryVector = np.asarray(embeddingModel.embed_query(query), dtype=np.float32)
+    queryVector = queryVector / (np.linalg.norm(queryVector) or 1.0)
+    similarities = sentenceVectors @ queryVector
+
+    selectedIndexes = set()
+    usedTokens = 0
+    for flatIndex in np.argsort(-similarities):
+        sentenceTokens = count_tokens(flatSentences[flatIndex][1])
+        if usedTokens + sentenceTokens > tokenBudget and selectedIndexes:
+            continue
+        selectedIndexes.add(int(flatIndex))
+        usedTokens += sentenceTokens
+
+    compressedTexts = [[] for _ in docs]
+    for flatIndex, (docIndex, sentence) in enumerate(flatSentences):
+        if flatIndex in selectedIndexes:
+            compressedTexts[docIndex].append(sentence)
+    return [" ".join(sentences) for sentences in compressedTexts]
+
+
+def format_scored_passages(scoredDocs, appConfig, parentStore=None, query=None, embeddingModel=None):
+    """
+    Formats retrieved (document, score) pairs as numbered passages with source attribution.
+    With a query and embedding model, passages are compressed to their most relevant
+    sentences; otherwise each passage is truncated to its share of the character budget.
+    """
+    if parentStore:
+        scoredDocs = expand_to_parents(scoredDocs, parentStore)
+    
+    contents = None
+    if appConfig["ContextCompressionEnabled"] and query and embeddingModel is not None:
+        try:
+            contents = compress_passages(query, [doc for doc, _ in scoredDocs], embeddingModel, appConfig["ContextTokenBudget"])
+        except Exception as e:
+            print(f"Error compressing passages: {e}")
+    if contents is None:
+        # Fewer, stronger hits get more room each; the total stays within budget
+        charsPerDoc = max(200, appConfig["RetrieverContextChars"] // len(scoredDocs))
+        contents = [doc.page_content[:charsPerDoc] for doc, _ in scoredDocs]
+    
+    results = []
+    for (doc, score), content in zip(scoredDocs, contents):
+        if not content:
+            continue
+        if doc.metadata.get("origin") == "web":
+            source = doc.metadata["source"]
+        else:
+            source = os.path.basename(doc.metadata.get("source", "unknown"))
+        page = doc.metadata.get("page", "N/A")
+        results.append(f"[{len(results) + 1}] Source: {source} (Page {page}) | Relevance: {score:.2f}\n{content}")
+    
+    return "\n\n".join(results)
+
+
+# Relevance gate: decide "documents are sufficient" vs "fall back to web" without an LLM call
+
+CROSS_ENCODERS = {}
+CROSS_ENCODERS_LOCK = threading.Lock()
+
+def get_cross_encoder(modelName):
+    """Returns a cached local cross-encoder, or None when not configured or not installed."""
+    if not modelName:
+        return None
+    try:
+        with CROSS_ENCODERS_LOCK:
+            if modelName not in CROSS_ENCODERS:
+                from sentence_transformers import CrossEncoder
+                CROSS_ENCODERS[modelName] = CrossEncoder(modelName)
+            return CROSS_ENCODERS[modelName]
+    except Exception as e:
+        print(f"Cross-encoder unavailable ({e}); using similarity scores only.")
+        with CROSS_ENCODERS_LOCK:
+            CROSS_ENCODERS[modelName] = None
+        return None
+
+
+def relevance_features(query, scoredDocs, appConfig):
+    """Computes the features the relevance gate and its calibration work on."""
+    # Plain floats: FAISS returns np.float32 scores, which json.dumps rejects
+    scores = [float(score) for _, score in scoredDocs]
+    features = {
+        "TopScore": scores[0] if scores else 0.0,
+        "MeanTop3": float(np.mean(scores[:3])) if scores else 0.0,
+        "CrossScore": None
+    }
+    crossEncoder = get_cross_encoder(appConfig["RelevanceCrossEncoderModel"])
+    if crossEncoder is not None and scoredDocs:
+        logits = crossEncoder.predict([(query, doc.page_content) for doc, _ in scoredDocs[:3]])
+        features["CrossScore"] = float(np.max(1.0 / (1.0 + np.exp(-np.asarray(logits)))))
+    return features
+
+
+def documents_are_sufficient(features, appConfig, folderThresholds=None):
+    """Gate decision using calibrated per-folder thresholds when available."""
+    folderThresholds = folderThresholds or {}
+    if features["CrossScore"] is not None:
+        return features["CrossScore"] >= folderThresholds.get("CrossScore", 0.5)
+    return features["TopScore"] >= folderThresholds.get("TopScore", appConfig["RelevanceGateThreshold"])
+
+
+def answer_supported_by_documents(answer, scoredDocs, embeddingModel, similarityThreshold):
+    """
+    Weak label for calibration, independent of the gate decision: at least half
+    of the answer's sentences have a close match among the sentences of the top
+    retrieved passages. A web-sourced answer the documents also contain counts
+    as positive, so calibration can lower a threshold as well as raise it.
+    """
+    answerSentences = [
+        sentence.strip() for sentence in SENTENCE_SPLIT_PATTERN.split(answer)
+        if sentence.strip() and not sentence.strip().startswith("Source:")
+    ]
+    documentSentences = [
+        sentence.strip() for doc, _ in scoredDocs[:3]
+        for sentence in SENTENCE_SPLIT_PATTERN.split(doc.page_content) if sentence.strip()
+    ]
+    if not answerSentences or not documentSentences:
+        return False
+    answerVectors = np.asarray(embeddingModel.embed_documents(answerSentences), dtype=np.float32)
+    documentVectors = np.asarray(embeddingModel.embed_documents(documentSentences), dtype=np.float32)
+    answerVectors = answerVectors / np.maximum(np.linalg.norm(answerVectors, axis=1, keepdims=True), 1e-12)
+    documentVectors = documentVectors / np.maximum(np.linalg.norm(documentVectors, axis=1, keepdims=True), 1e-12)
+    bestMatches = (answerVectors @ documentVectors.T).max(axis=1)
+    return float(np.mean(bestMatches >= similarityThreshold)) >= 0.5
+
+
+def append_relevance_log(vectorPath, query, features, answer, scoredDocs, embeddingModel, appConfig):
+    """Logs gate features and the weak label of one turn to the folder's relevance log."""
+    try:
+        isSupported = answer_supported_by_documents(answer, scoredDocs, embeddingModel, appConfig["RelevanceLabelSimilarity"])
+        logLine = json.dumps({"query": query, **features, "Label": isSupported})
+        with open(os.path.join(vectorPath, "relevance_log.jsonl"), "a", encoding="utf-8") as logFile:
+            logFile.write(logLine + "\n")
+    except Exception as e:
+        print(f"Error writing relevance log: {e}")
+
+
+def fit_relevance_thresholds(vectorPath):
+    """
+    Fits per-folder gate thresholds from the relevance log by picking, for each
+    feature, the cut-off with the best balanced accuracy. Saves and returns them.
+    """
+    logPath = os.path.join(vectorPath, "relevance_log.jsonl")
+    if not os.path.exists(logPath):
+        return {}
+    with open(logPath, "r", encoding="utf-8") as logFile:
+        entries = [json.loads(line) for line in logFile if line.strip()]
+
+    thresholds = {"SampleCount": len(entries)}
+    for featureName in ("TopScore", "CrossScore"):
+        samples = [(e[featureName], e["Label"]) for e in entries if e.get(featureName) is not None]
+        positives = sum(1 for _, label in samples if label)
+        negatives = len(samples) - positives
+        if not positives or not negatives:
+            continue
+        bestThreshold, bestAccuracy = None, -1.0
+        for candidate in sorted({value for value, _ in samples}):
+            truePositive = sum(1 for value, label in samples if label and value >= candidate)
+            trueNegative = sum(1 for value, label in samples if not label and value < candidate)
+            balancedAccuracy = (truePositive / positives + trueNegative / negatives) / 2
+            if balancedAccuracy > bestAccuracy:
+                bestThreshold, bestAccuracy = candidate, balancedAccuracy
+        thresholds[featureName] = bestThreshold
+        thresholds[f"{featureName}BalancedAccuracy"] = round(bestAccuracy, 3)
+
+    with open(os.path.join(vectorPath, "relevance_thresholds.json"), "w", encoding="utf-8") as thresholdFile:
+        json.dump(thresholds, thresholdFile, indent=2)
+    return thresholds
+
+
+# Speculative retrieval: results started before the agent asks for them
+
+class RetrievalPrefetcher:
+    """
+    Short-lived store of retrievals started ahead of the agent, per vector store:
+    either the fast-path router's finished retrieval (reused, no overlap) or one
+    running in the background during the first planning call (fast path off).
+    document_search takes a prefetched result when its query matches exactly or
+    its embedding is close enough to the prefetched query. Retrieval is
+    deterministic per folder, so entries can be shared between sessions.
+    """
+
+    def __init__(self, maxWorkers=4):
+        self.executor = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix="prefetch")
+        self.entries = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalize(query):
+        return " ".join(query.lower().split())
+
+    def add_entry(self, vectorStore, query, future, appConfig):
+        with self.lock:
+            now = time.time()
+            self.entries = [e for e in self.entries if now - e["CreatedAt"] < appConfig["PrefetchTtlSeconds"]]
+            self.entries.append({
+                "StoreId": id(vectorStore),
+                "Query": self.normalize(query),
+                "Future": future,
+                "CreatedAt": now
+            })
+
+    def start(self, vectorStore, query, appConfig, documentIndex=None):
+        """Starts retrieval for a query in the background."""
+        def prefetch():
+            queryVector = vectorStore.embeddings.embed_query(query)
+            return queryVector, search_with_adaptive_k(vectorStore, query, appConfig, documentIndex)
+        self.add_entry(vectorStore, query, self.executor.submit(prefetch), appConfig)
+
+    def store(self, vectorStore, query, scoredDocs, appConfig):
+        """Registers a retrieval that was already done (e.g. by the fast-path router)."""
+        future = self.executor.submit(lambda: (vectorStore.embeddings.embed_query(query), scoredDocs))
+        self.add_entry(vectorStore, query, future, appConfig)
+
+    def lookup(self, vectorStore, query, appConfig):
+        """Returns prefetched scored documents for a matching query, or None."""
+        try:
+            with self.lock:
+                now = time.time()
+                candidates = [
+                    e for e in self.entries
+                    if e["StoreId"] == id(vectorStore) and now - e["CreatedAt"] < appConfig["PrefetchTtlSeconds"]
+                ]
+            if not candidates:
+                return None
+
+            normalizedQuery = self.normalize(query)
+            for entry in reversed(candidates):
+                if entry["Query"] == normalizedQuery:
+                    return entry["Future"].result()[1]
+
+            queryVector = np.asarray(vectorStore.embeddings.embed_query(query), dtype=np.float32)
+            queryVector = queryVector / (np.linalg.norm(queryVector) or 1.0)
+            for entry in reversed(candidates):
+                prefetchedVector, scoredDocs = entry["Future"].result()
+                prefetchedVector = np.asarray(prefetchedVector, dtype=np.float32)
+                prefetchedVector = prefetchedVector / (np.linalg.norm(prefetchedVector) or 1.0)
+                if float(prefetchedVector @ queryVector) >= appConfig["PrefetchSimilarityThreshold"]:
+                    return scoredDocs
+        except Exception as e:
+            print(f"Error reading prefetched retrieval: {e}")
+        return None
+
+RETRIEVAL_PREFETCHER = RetrievalPrefetcher()
+
+
+# Web results used in answers become local retrievals for the next user
+
+WEB_RESULT_PATTERN = re.compile(r"^\[\d+\] (.*)\n    (.*)\n    Link: (.*)$", re.MULTILINE)
+WEB_FALLBACK_MARKER = "Web search results:\n"
+
+def merge_supplemental_results(scoredDocs, query, folderIndexes, appConfig):
+    """Adds hits from the folder's web supplement index, ordered by score, without duplicates."""
+    webSupplement = (folderIndexes or {}).get("WebSupplement")
+    if webSupplement is None or not appConfig["WebIngestEnabled"]:
+        return scoredDocs
+    supplementDocs = webSupplement.search(query, appConfig)
+    if not supplementDocs:
+        return scoredDocs
+    seenKeys = set()
+    mergedDocs = []
+    for doc, score in sorted(list(scoredDocs) + supplementDocs, key=lambda pair: pair[1], reverse=True):
+        docKey = (doc.metadata.get("source"), doc.page_content)
+        if docKey not in seenKeys:
+            seenKeys.add(docKey)
+            mergedDocs.append((doc, score))
+    return mergedDocs
+
+def extract_used_web_results(intermediateSteps, answer):
+    """
+    Parses the web results seen during a turn (web_search calls and the
+    document_search web fallback) and keeps the ones the answer used: results
+    whose link it cites, or all of them when it cites web search without a link.
+    """
+    webResults = []
+    for action, observation in intermediateSteps:
+        observation = str(observation)
+        if action.tool == "document_search" and WEB_FALLBACK_MARKER in observation:
+            observation = observation.split(WEB_FALLBACK_MARKER, 1)[1]
+        elif action.tool != "web_search":
+            continue
+        searchQuery = action.tool_input.get("query", "") if isinstance(action.tool_input, dict) else str(action.tool_input)
+        for title, snippet, link in WEB_RESULT_PATTERN.findall(observation):
+            webResults.append({"Title": title.strip(), "Snippet": snippet.strip(), "Link": link.strip(), "Query": searchQuery})
+    citedResults = [result for result in webResults if result["Link"] and result["Link"] in answer]
+    if citedResults:
+        return citedResults
+    return webResults if "Source: Web Search" in answer else []
+
+def ingest_web_results(folderIndexes, intermediateSteps, answer, appConfig):
+    """Stores the web results an answer used in the folder's web supplement index."""
+    webSupplement = (folderIndexes or {}).get("WebSupplement")
+    if webSupplement is None or not appConfig["WebIngestEnabled"] or not intermediateSteps:
+        return
+    usedResults = extract_used_web_results(intermediateSteps, answer)
+    if usedResults:
+        webSupplement.add(usedResults, appConfig)
+
+
+def create_rag_search_tool(vectorStore, appConfig, folderIndexes=None, webSearchFn=None):
+    """
+    Creates the RAG document search tool with score-based adaptive retrieval depth.
+    With webSearchFn, the relevance gate falls back to web search inside the tool
+    for on-topic (Buzz/Skyscape) questions, so the agent does not need another
+    planning round trip to do it. Other questions keep the passages that cleared
+    the score threshold and leave any web search to the agent.
+    """
+    folderIndexes = folderIndexes or {}
+    documentIndex = folderIndexes.get("DocumentIndex")
+    parentStore = folderIndexes.get("ParentStore")
     
     @tool("document_search", args_schema=RagSearchInput)
     def rag_search_tool(query: str) -> str:
@@ -390,32 +2108,116 @@ def create_rag_search_tool(retriever):
         Returns relevant passages from the documents.
         """
         try:
-            docs = retriever.invoke(query)
-            if not docs:
-                return "No relevant information found in the documents."
+            scoredDocs = None
+            if appConfig["SpeculativeRetrievalEnabled"]:
+                scoredDocs = RETRIEVAL_PREFETCHER.lookup(vectorStore, query, appConfig)
+            if scoredDocs is None:
+                scoredDocs = search_with_adaptive_k(vectorStore, query, appConfig, documentIndex)
+            scoredDocs = merge_supplemental_results(scoredDocs, query, folderIndexes, appConfig)
+            
+            passages = format_scored_passages(scoredDocs, appConfig, parentStore, query, vectorStore.embeddings) if scoredDocs else ""
             
-            results = []
-            for i, doc in enumerate(docs, 1):
-                source = os.path.basename(doc.metadata.get("source", "unknown"))
-                page = doc.metadata.get("page", "N/A")
-                content = doc.page_content[:500]  
-                results.append(f"[{i}] Source: {source} (Page {page})\n{content}")
+            if appConfig["RelevanceGateEnabled"] and webSearchFn is not None:
+                features = relevance_features(query, scoredDocs, appConfig)
+                if not documents_are_sufficient(features, appConfig, folderIndexes.get("RelevanceThresholds")):
+                    # Off-topic questions must not trigger a web search on their own
+                    if PRODUCT_QUESTION_PATTERN.search(query) is None:
+                        if not passages:
+                            return "No relevant information found in the documents."
+                        return "Note: the documents may be insufficient for this question.\n\n" + passages
+                    gateNote = "The documents do not contain a sufficient answer (relevance gate). "
+                    if passages:
+                        gateNote = "The documents may be insufficient (relevance gate).\n\n" + passages + "\n\n"
+                    return gateNote + WEB_FALLBACK_MARKER + webSearchFn(query)
+            
+            if not passages:
+                return "No relevant information found in the documents."
             
-            return "\n\n".join(results)
+            return passages
         except Exception as e:
             return f"Error searching documents: {e}"
     
     return rag_search_tool
 
 
+def with_tool_timeout(baseTool, timeoutSeconds):
+    """
+    Returns a copy of a tool that also has an async implementation bounded by
+    a timeout. The sync path is unchanged; on the async path the tool runs in
+    a worker thread so several tool calls from one agent step overlap.
+    """
+    async def run_with_timeout(**kwargs):
+        try:
+            return await asyncio.wait_for(asyncio.to_thread(baseTool.func, **kwargs), timeout=timeoutSeconds)
+        except asyncio.TimeoutError:
+            return f"{baseTool.name} timed out after {timeoutSeconds:g} seconds. Continue with the information available."
+
+    return StructuredTool.from_function(
+        func=baseTool.func,
+        coroutine=run_with_timeout,
+        name=baseTool.name,
+        description=baseTool.description,
+        args_schema=baseTool.args_schema
+    )
+
+
+def fetch_recent_folder_ids(mongoDatabase, folderCount):
+    """Returns ids of the most recently active folders, ranked by SessionMetadata.LastActive."""
+    try:
+        folderIds = []
+        recentSessions = mongoDatabase["SessionMetadata"].find({}, {"FolderId": 1}).sort("LastActive", -1)
+        for session in recentSessions:
+            folderId = session.get("FolderId")
+            if folderId and folderId not in folderIds:
+                folderIds.append(folderId)
+            if len(folderIds) >= folderCount:
+                break
+        return folderIds
+    except Exception as e:
+        print(f"Error fetching recent folders: {e}")
+        return []
+
+
+def warm_up_folders(mongoDatabase, embeddingModel, appConfig):
+    """Preloads recently active folders and runs a dummy query through each one."""
+    try:
+        for folderId in fetch_recent_folder_ids(mongoDatabase, appConfig["WarmupFolderCount"]):
+            folderRecord = fetch_folder_by_id(mongoDatabase, folderId, appConfig["CollectionName"])
+            if not folderRecord:
+                continue
+            vectorStore, folderIndexes = get_loaded_folder(folderRecord, embeddingModel)
+            if vectorStore:
+                # Touches the embedding model and pages the FAISS index into memory
+                search_with_adaptive_k(vectorStore, "warm up", appConfig, folderIndexes.get("DocumentIndex"))
+    except Exception as e:
+        print(f"Error during warm-up: {e}")
+
+
+def start_warm_up(mongoDatabase, embeddingModel, appConfig):
+    """Starts the folder warm-up on a daemon thread so the menu is not blocked."""
+    try:
+        warmupThread = threading.Thread(
+            target=warm_up_folders,
+            args=(mongoDatabase, embeddingModel, appConfig),
+            daemon=True
+        )
+        warmupThread.start()
+        return warmupThread
+    except Exception as e:
+        print(f"Error starting warm-up: {e}")
+        return None
+
+
 #MongoDB Chat History 
 
 def get_mongodb_chat_history(appConfig, sessionId):
     """Returns MongoDB chat history for the given session."""
     try:
+        # Reuses the shared client instead of opening a new pool per session
         return MongoDBChatMessageHistory(
             session_id=sessionId,
-            connection_string=appConfig["MongoUrl"],
+            connection_string=None,
+            client=get_mongo_client(appConfig),
             database_name=appConfig["DbName"],
             collection_name=appConfig["ChatCollectionName"]
         )
@@ -436,6 +2238,166 @@ def load_history_as_messages(chatHistory):
     return messages
 
 
+def fit_history_to_budget(messages, tokenBudget):
+    """
+    Splits messages into (older, recent) where recent is the newest run of
+    whole messages that fits in tokenBudget. The latest message is always kept.
+    """
+    usedTokens = 0
+    splitIndex = len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        messageTokens = count_tokens(str(messages[i].content))
+        if usedTokens + messageTokens > tokenBudget and splitIndex < len(messages):
+            break
+        usedTokens += messageTokens
+        splitIndex = i
+    return messages[:splitIndex], messages[splitIndex:]
+
+
+def new_history_state(recentMessages=None, runningSummary="", summarizedCount=0):
+    """Creates the per-session history state used by chat_loop."""
+    return {
+        "Recent": list(recentMessages or []),
+        "OmittedCount": 0,
+        "OmittedQuestions": [],
+        "Summary": runningSummary,
+        "Pending": [],
+        "PendingStart": summarizedCount,
+        "SummaryJob": None,
+        "Lock": threading.Lock()
+    }
+
+
+def add_omitted_messages(historyState, olderMessages):
+    """Moves messages out of the recent window into the digest and the summary backlog."""
+    historyState["OmittedCount"] += len(olderMessages)
+    with historyState["Lock"]:
+        historyState["Pending"].extend(olderMessages)
+    for msg in olderMessages:
+        if isinstance(msg, HumanMessage):
+            historyState["OmittedQuestions"].append(str(msg.content)[:120])
+    historyState["OmittedQuestions"] = historyState["OmittedQuestions"][-5:]
+
+
+def load_recent_history(mongoDatabase, appConfig, sessionId):
+    """
+    Loads only the newest messages of a session that fit the history token budget.
+    Uses a bounded, newest-first query instead of reading the whole session.
+    Returns a history state dict: recent messages, the stored running summary
+    and a compact digest of older turns.
+    """
+    sessionMeta = fetch_session_details(mongoDatabase, sessionId) or {}
+    summarizedCount = sessionMeta.get("SummarizedCount", 0)
+    historyState = new_history_state(runningSummary=sessionMeta.get("RunningSummary", ""), summarizedCount=summarizedCount)
+    try:
+        chatCollection = mongoDatabase[appConfig["ChatCollectionName"]]
+        cursor = chatCollection.find(
+            {"SessionId": sessionId}, {"History": 1}
+        ).sort("_id", -1).limit(appConfig["HistoryFetchLimit"])
+        fetchedMessages = messages_from_dict([json.loads(doc["History"]) for doc in cursor][::-1])
+
+        olderMessages, historyState["Recent"] = fit_history_to_budget(fetchedMessages, appConfig["HistoryTokenBudget"])
+        add_omitted_messages(historyState, olderMessages)
+
+        # Messages outside the fetch window are only counted
+        totalCount = chatCollection.count_documents({"SessionId": sessionId})
+        windowStart = max(0, totalCount - len(fetchedMessages))
+        historyState["OmittedCount"] += windowStart
+
+        # Older messages already covered by the running summary are not summarized again
+        historyState["Pending"] = historyState["Pending"][max(0, summarizedCount - windowStart):]
+        historyState["PendingStart"] = max(summarizedCount, windowStart)
+    except Exception as e:
+        print(f"Error loading history: {e}")
+    return historyState
+
+
+def add_turn_to_history(historyState, userQuery, answer, tokenBudget):
+    """Appends a finished turn and moves messages that no longer fit into the digest."""
+    historyState["Recent"].extend([HumanMessage(content=userQuery), AIMessage(content=answer)])
+    olderMessages, historyState["Recent"] = fit_history_to_budget(historyState["Recent"], tokenBudget)
+    add_omitted_messages(historyState, olderMessages)
+
+
+def history_for_agent(historyState):
+    """Builds the chat_history passed to the agent: summary or digest of older turns + recent messages."""
+    if historyState["Summary"]:
+        # Messages already out of the recent window but not yet folded into the summary
+        with historyState["Lock"]:
+            pendingQuestions = [str(msg.content)[:120] for msg in historyState["Pending"] if isinstance(msg, HumanMessage)]
+        digest = f"[Summary of earlier conversation: {historyState['Summary']}"
+        if pendingQuestions:
+            digest += " | Later questions not yet in the summary: " + " | ".join(pendingQuestions)
+        digest += "]"
+        return [HumanMessage(content=digest)] + list(historyState["Recent"])
+    if not historyState["OmittedCount"]:
+        return list(historyState["Recent"])
+    digest = f"[Earlier conversation: {historyState['OmittedCount']} older messages not shown."
+    if historyState["OmittedQuestions"]:
+        digest += " Earlier questions included: " + " | ".join(historyState["OmittedQuestions"])
+    digest += "]"
+    return [HumanMessage(content=digest)] + list(historyState["Recent"])
+
+
+# Single worker: summaries run off the chat path and never pile up in parallel
+SUMMARY_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary")
+
+def summarize_history_increment(llm, previousSummary, newMessages):
+    """Folds newly omitted messages into the running summary with one LLM call."""
+    conversationText = ""
+    for msg in newMessages:
+        role = "User" if isinstance(msg, HumanMessage) else "Assistant"
+        conversationText += f"{role}: {msg.content}\n"
+
+    summaryPrompt = f"""Update the running summary of a conversation with the new messages below.
+Capture key points, questions asked, and answers provided. Keep it under 200 words.
+
+Current summary:
+{previousSummary or "(none)"}
+
+New messages:
+{conversationText}
+
+Updated summary:"""
+
+    summaryResponse = llm.invoke(summaryPrompt)
+    return format_agent_response(summaryResponse.content)
+
+
+def run_summary_job(mongoDatabase, llm, sessionId, historyState):
+    """Background job: summarizes the pending backlog and persists the result."""
+    try:
+        with historyState["Lock"]:
+            batch = list(historyState["Pending"])
+            previousSummary = historyState["Summary"]
+        if not batch:
+            return
+
+        newSummary = summarize_history_increment(llm, previousSummary, batch)
+
+        with historyState["Lock"]:
+            historyState["Summary"] = newSummary
+            historyState["Pending"] = historyState["Pending"][len(batch):]
+            historyState["PendingStart"] += len(batch)
+            summarizedCount = historyState["PendingStart"]
+        save_session_summary(mongoDatabase, sessionId, newSummary, summarizedCount)
+    except Exception as e:
+        print(f"\nError updating history summary: {e}")
+
+
+def schedule_history_summary(mongoDatabase, llm, sessionId, historyState, appConfig):
+    """Starts a background summary update once the unsummarized backlog passes the trigger size."""
+    if not appConfig["HistorySummaryEnabled"]:
+        return
+    runningJob = historyState["SummaryJob"]
+    if runningJob is not None and not runningJob.done():
+        return
+    with historyState["Lock"]:
+        backlogSize = len(historyState["Pending"])
+    if backlogSize >= appConfig["HistorySummaryTrigger"]:
+        historyState["SummaryJob"] = SUMMARY_EXECUTOR.submit(run_summary_job, mongoDatabase, llm, sessionId, historyState)
+
+
 def format_agent_response(response):
     """
     Cleans and formats the agent response.
@@ -483,8 +2445,11 @@ def format_agent_response(response):
         print(f"Error formatting response: {e}")
         return str(response)
 
-def build_agent_prompt(webSearchEnabled):
-    """Builds the system prompt for the agent based on configuration."""
+def build_agent_system_prompt(webSearchEnabled):
+    """
+    Returns the agent system prompt text. It must stay free of per-request
+    values (dates, session ids, history) so it forms a byte-identical prefix.
+    """
     try:
         # Dynamic instruction for web search based on availability
         if webSearchEnabled:
@@ -576,50 +2541,164 @@ If the user asks a compound question (e.g., "What is Buzz and what is SQL?"):
 - No unnecessary text.  
 - No speculation.
 """
-        
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", systemPrompt),
+        return systemPrompt
+    except Exception as e:
+        print(f"Error building agent system prompt: {e}")
+        return None
+
+
+def build_agent_prompt(webSearchEnabled, includeSystemPrompt=True):
+    """
+    Builds the agent prompt. Static parts come first (system prompt, then the
+    tool schemas the client adds), history and the question after them.
+    includeSystemPrompt=False is used when the provider already holds the
+    system prompt in a registered context cache.
+    """
+    try:
+        promptMessages = []
+        if includeSystemPrompt:
+            systemPrompt = build_agent_system_prompt(webSearchEnabled)
+            if systemPrompt is None:
+                return None
+            promptMessages.append(("system", systemPrompt))
+        promptMessages.extend([
             MessagesPlaceholder(variable_name="chat_history"),
             ("human", "{input}"),
             MessagesPlaceholder(variable_name="agent_scratchpad"),
         ])
-        
-        return prompt
+        return ChatPromptTemplate.from_messages(promptMessages)
     except Exception as e:
         print(f"Error building agent prompt: {e}")
         return None
 
 
-def create_agent_executor(llm, vectorStore, appConfig, webSearchEnabled=True):
+# Stable prompt prefix and provider-side context caching
+
+PROVIDER_PREFIX_CACHES = {}
+PROVIDER_PREFIX_LOCK = threading.Lock()
+
+def compute_prompt_prefix(systemPrompt, tools):
+    """
+    Returns the static prompt prefix (system prompt + canonical tool schemas)
+    and its SHA-256. Identical settings always produce identical bytes.
+    """
+    toolSchemas = [convert_to_openai_tool(t)["function"] for t in tools]
+    prefixText = systemPrompt + "\n" + json.dumps(toolSchemas, sort_keys=True, separators=(",", ":"))
+    return {"Text": prefixText, "Hash": hashlib.sha256(prefixText.encode("utf-8")).hexdigest(), "ToolSchemas": toolSchemas}
+
+
+def register_prompt_prefix(appConfig, model, systemPrompt, promptPrefix):
+    """
+    Registers the static prefix with the provider's context-caching API
+    (POST /v1beta/cachedContents) and returns the cached content name.
+    Registrations are reused per prefix hash until shortly before they expire.
+    """
+    try:
+        with PROVIDER_PREFIX_LOCK:
+            cachedEntry = PROVIDER_PREFIX_CACHES.get(promptPrefix["Hash"])
+            if cachedEntry and cachedEntry["ExpiresAt"] - 60 > time.time():
+                return cachedEntry["Name"]
+
+        ttlSeconds = appConfig["ProviderPromptCacheTtlSeconds"]
+        requestBody = {
+            "model": f"models/{model}",
+            "displayName": f"buzzbot-{promptPrefix['Hash'][:16]}",
+            "systemInstruction": {"parts": [{"text": systemPrompt}]},
+            "tools": [{"functionDeclarations": promptPrefix["ToolSchemas"]}],
+            "ttl": f"{ttlSeconds}s"
+        }
+        endpoint = appConfig["ProviderPromptCacheEndpoint"].rstrip("/")
+        httpRequest = urllib.request.Request(
+            f"{endpoint}/v1beta/cachedContents?key={appConfig['GoogleApiKey']}",
+            data=json.dumps(requestBody).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        with urllib.request.urlopen(httpRequest, timeout=10) as httpResponse:
+            cacheName = json.loads(httpResponse.read().decode("utf-8"))["name"]
+
+        with PROVIDER_PREFIX_LOCK:
+            PROVIDER_PREFIX_CACHES[promptPrefix["Hash"]] = {"Name": cacheName, "ExpiresAt": time.time() + ttlSeconds}
+        return cacheName
+    except Exception as e:
+        print(f"Error registering prompt prefix with provider cache: {e}")
+        return None
+
+
+# Bump when build_agent_prompt changes so cached executors are rebuilt
+AGENT_PROMPT_VERSION = "1"
+
+AGENT_EXECUTORS = {}
+AGENT_EXECUTORS_LOCK = threading.Lock()
+
+def get_agent_executor(llm, vectorStore, appConfig, webSearchEnabled, folderIndexes, folderId):
+    """Returns a cached agent executor for the folder, web-search flag, prompt version and LLM client."""
+    executorKey = (str(folderId), webSearchEnabled, AGENT_PROMPT_VERSION, id(llm))
+    with AGENT_EXECUTORS_LOCK:
+        # Rebuild when the provider-side prefix cache the executor points at has expired
+        cachedExecutor = AGENT_EXECUTORS.get(executorKey)
+        if cachedExecutor is not None and (cachedExecutor.metadata or {}).get("ProviderCacheName"):
+            with PROVIDER_PREFIX_LOCK:
+                prefixEntry = PROVIDER_PREFIX_CACHES.get(cachedExecutor.metadata["PromptPrefixHash"])
+            if not prefixEntry or prefixEntry["ExpiresAt"] - 60 <= time.time():
+                del AGENT_EXECUTORS[executorKey]
+        if executorKey not in AGENT_EXECUTORS:
+            executor = create_agent_executor(llm, vectorStore, appConfig, webSearchEnabled, folderIndexes)
+            if executor is None:
+                return None
+            AGENT_EXECUTORS[executorKey] = executor
+        return AGENT_EXECUTORS[executorKey]
+
+def create_agent_executor(llm, vectorStore, appConfig, webSearchEnabled=True, folderIndexes=None):
     """
     Creates an Agent Executor
     """
     try:
-        # Create retriever from vector store
-        retriever = vectorStore.as_retriever(search_kwargs={"k": 5})
-        
-        # Create tools
-        ragTool = create_rag_search_tool(retriever)
-        webTool = create_web_search_tool(appConfig, enabled=webSearchEnabled)
+        # Create tools (timeouts apply when the executor runs asynchronously)
+        baseWebTool = create_web_search_tool(appConfig, enabled=webSearchEnabled)
+        webSearchFn = baseWebTool.func if webSearchEnabled else None
+        ragTool = with_tool_timeout(create_rag_search_tool(vectorStore, appConfig, folderIndexes, webSearchFn), appConfig["DocumentSearchTimeout"])
+        webTool = with_tool_timeout(baseWebTool, appConfig["WebSearchTimeout"])
         
         tools = [ragTool, webTool]
         
-        # Build the agent prompt
-        prompt = build_agent_prompt(webSearchEnabled)
+        # Static prefix: system prompt + tool schemas, hashed for cache tracking
+        systemPrompt = build_agent_system_prompt(webSearchEnabled)
+        if systemPrompt is None:
+            print("Error: Failed to build agent prompt.")
+            return None
+        promptPrefix = compute_prompt_prefix(systemPrompt, tools)
+        emit_agent_event(appConfig, {"event": "prompt_prefix", "hash": promptPrefix["Hash"],
+                                     "tokens": count_tokens(promptPrefix["Text"])})
+        
+        # With a registered provider cache the prefix is not re-sent on each request
+        agentLlm = llm
+        cacheName = None
+        if appConfig["ProviderPromptCacheEnabled"] and appConfig["LlmBackend"] == "gemini":
+            cacheName = register_prompt_prefix(appConfig, getattr(llm.innerModel, "model", appConfig["LlmModel"]).replace("models/", ""),
+                                               systemPrompt, promptPrefix)
+        if cacheName:
+            # Requests then send only cached_content; the tools live in the cache
+            agentLlm = llm.model_copy(update={"cachedContent": cacheName})
+        
+        prompt = build_agent_prompt(webSearchEnabled, includeSystemPrompt=cacheName is None)
         if prompt is None:
             print("Error: Failed to build agent prompt.")
             return None
         
         # Create the agent
-        agent = create_tool_calling_agent(llm, tools, prompt)
+        agent = create_tool_calling_agent(agentLlm, tools, prompt)
         
         # Create executor 
         executor = AgentExecutor(
             agent=agent,
             tools=tools,
-            verbose=True, 
+            verbose=appConfig["AgentVerbose"], 
             handle_parsing_errors=True,
-            max_iterations=5
+            max_iterations=appConfig["AgentMaxIterations"],
+            max_execution_time=appConfig["AgentMaxSeconds"],
+            return_intermediate_steps=True,
+            metadata={"PromptPrefixHash": promptPrefix["Hash"], "ProviderCacheName": cacheName}
         )
         
         return executor
@@ -629,9 +2708,350 @@ def create_agent_executor(llm, vectorStore, appConfig, webSearchEnabled=True):
         traceback.print_exc()
         return None
 
+# Fast-path routing: answer with one LLM call when the agent is not needed
+
+# First-person questions about the conversation itself. "Chat" and "conversation" alone are
+# Buzz product terms ("How do I delete this chat in Buzz?"), so they do not count
+META_QUESTION_PATTERN = re.compile(
+    r"\b(what (did|have) i (just )?(ask|asked|say|said)|what (did|have) you (just )?(say|said|tell|told) me|"
+    r"(what|which) (was|were) my (previous|last|earlier|first) (question|message)s?|"
+    r"(summari[sz]e|recap) (our|this) (conversation|chat)( so far)?|"
+    r"(list|repeat) (the|my) (questions|messages) i (have )?(asked|sent)( you)?|"
+    r"(earlier|before) (i|you) (asked|said))\b",
+    re.IGNORECASE
+)
+
+# Product and how-to wording: such questions always go to the documents
+PRODUCT_QUESTION_PATTERN = re.compile(
+    r"\b(buzz\w*|skyscape|lightning|app|notifications?|mute|unmute|delete|export|archive|download|"
+    r"install|settings?|account|groups?|channels?|read receipts?|how (do|can|to|would|should))\b",
+    re.IGNORECASE
+)
+
+META_QUESTION_EXAMPLES = [
+    "What did I ask earlier?",
+    "What was my previous question?",
+    "Summarize our conversation so far.",
+    "List the questions I have asked.",
+    "What did you tell me before?"
+]
+
+def get_meta_question_vectors(embeddingModel):
+    """Embeds the meta-question examples once per chat session, normalized for cosine similarity."""
+    try:
+        exampleVectors = np.asarray(embeddingModel.embed_documents(META_QUESTION_EXAMPLES), dtype=np.float32)
+        return exampleVectors / np.linalg.norm(exampleVectors, axis=1, keepdims=True)
+    except Exception as e:
+        print(f"Error embedding meta-question examples: {e}")
+        return None
+
+
+# Follow-up detection and query condensing (only when a follow-up is likely)
+
+# Unresolved references only: a continuation word at the start, personal pronouns (not the
+# expletive "is it possible"), demonstratives standing alone ("what does that mean?"), or
+# "the same/above/former/latter". "Is there a way..." and "know that a message..." do not match
+FOLLOW_UP_PATTERN = re.compile(
+    r"^(and|also|or|but|so|then|what about|how about|how come)\b"
+    r"|\b(its|they|them|their|he|she|him|her)\b"
+    r"|\bit\b(?!'?s? (is )?(possible|necessary|required|safe|true))"
+    r"|\b(this|that|these|those)(\s*[?.!]|\s*$|\s+(is|was|are|were|does|do|did|mean|means|one|ones|work|works|up|on|off|out)\b)"
+    r"|^(is|are|was|were|does|do|did|can|will) (this|that|these|those)\b"
+    r"|\bthe (same|above|former|latter)\b|\.\.\.$",
+    re.IGNORECASE
+)
+
+def looks_like_follow_up(userQuery, queryVector, centroid, appConfig):
+    """
+    Cheap local detector for questions that depend on earlier turns:
+    unresolved references or ellipsis, or low similarity to the folder centroid.
+    Very short questions use the looser FollowUpShortQueryThreshold, but still
+    need a low centroid similarity.
+    """
+    if FOLLOW_UP_PATTERN.search(userQuery.strip()):
+        return True
+    if centroid is not None and queryVector is not None:
+        queryVector = np.asarray(queryVector, dtype=np.float32)
+        queryVector = queryVector / (np.linalg.norm(queryVector) or 1.0)
+        similarity = float(queryVector @ centroid)
+        if len(userQuery.split()) <= 3:
+            return similarity < appConfig["FollowUpShortQueryThreshold"]
+        return similarity < appConfig["FollowUpCentroidThreshold"]
+    return False
+
+
+def condense_query(llm, userQuery, chatHistoryMessages, rewriteCache):
+    """
+    Rewrites a follow-up into a standalone question with one LLM call.
+    Results are cached per session, keyed by the question and the last history message.
+    """
+    lastMessage = str(chatHistoryMessages[-1].content) if chatHistoryMessages else ""
+    cacheKey = (userQuery, hashlib.sha256(lastMessage.encode("utf-8")).hexdigest())
+    if cacheKey in rewriteCache:
+        rewriteCache.move_to_end(cacheKey)
+        return rewriteCache[cacheKey]
+
+    condensePrompt = ChatPromptTemplate.from_messages([
+        ("system", "Given a chat history and the latest user question "
+                   "which might reference context in the chat history, "
+                   "formulate a standalone question which can be understood "
+                   "without the chat history. Do NOT answer the question, "
+                   "just reformulate it if needed and otherwise return it as is."),
+        MessagesPlaceholder("chat_history"),
+        ("human", "{input}"),
+    ])
+    try:
+        response = (condensePrompt | llm).invoke({"input": userQuery, "chat_history": chatHistoryMessages})
+        standaloneQuery = format_agent_response(response.content).strip() or userQuery
+    except Exception as e:
+        print(f"Error condensing query: {e}")
+        return userQuery
+
+    rewriteCache[cacheKey] = standaloneQuery
+    while len(rewriteCache) > 256:
+        rewriteCache.popitem(last=False)
+    return standaloneQuery
+
+
+def route_query(userQuery, vectorStore, appConfig, folderIndexes, metaVectors, retrievalQuery=None):
+    """
+    Cheap local router. Returns {"Route": "meta" | "rag" | "agent", "ScoredDocs": [...]}.
+    meta: first-person questions about the conversation (rules, then embedding similarity),
+    never questions with Buzz product or how-to wording.
+    rag: the relevance gate passes and the top score is high enough to answer in one call.
+    agent: everything else goes through the full tool-calling agent.
+    retrievalQuery (a condensed follow-up) is used for retrieval instead of userQuery.
+    """
+    retrievalQuery = retrievalQuery or userQuery
+    try:
+        isProductQuestion = PRODUCT_QUESTION_PATTERN.search(userQuery) is not None
+        if META_QUESTION_PATTERN.search(userQuery) and not isProductQuestion:
+            return {"Route": "meta", "ScoredDocs": []}
+
+        if metaVectors is not None and not isProductQuestion:
+            queryVector = np.asarray(vectorStore.embeddings.embed_query(userQuery), dtype=np.float32)
+            queryVector = queryVector / (np.linalg.norm(queryVector) or 1.0)
+            if float(np.max(metaVectors @ queryVector)) >= appConfig["RouterMetaThreshold"]:
+                return {"Route": "meta", "ScoredDocs": []}
+
+        folderIndexes = folderIndexes or {}
+        scoredDocs = search_with_adaptive_k(vectorStore, retrievalQuery, appConfig, folderIndexes.get("DocumentIndex"))
+        scoredDocs = merge_supplemental_results(scoredDocs, retrievalQuery, folderIndexes, appConfig)
+        features = relevance_features(retrievalQuery, scoredDocs, appConfig)
+        routeInfo = {"Route": "agent", "ScoredDocs": scoredDocs, "Features": features, "Query": retrievalQuery}
+        if (scoredDocs and scoredDocs[0][1] >= appConfig["RouterRagThreshold"]
+                and documents_are_sufficient(features, appConfig, folderIndexes.get("RelevanceThresholds"))):
+            routeInfo["Route"] = "rag"
+        return routeInfo
+    except Exception as e:
+        print(f"Error routing query: {e}")
+    return {"Route": "agent", "ScoredDocs": []}
+
+
+def build_direct_answer_prompt(route):
+    """Builds the single-call prompt for the meta (history only) or rag (retrieve-then-answer) route."""
+    if route == "meta":
+        systemPrompt = """You are BuzzBot. The user is asking about this conversation itself.
+Answer ONLY from the chat_history (for example, list the user's earlier questions).
+Be concise. Do not invent earlier messages."""
+    else:
+        systemPrompt = """You are BuzzBot — a helpful AI assistant for the Buzz Application and Skyscape products.
+Answer the question using ONLY the document passages below. If they do not contain the answer, say so politely.
+
+- Cite your source on a separate line below the relevant text:
+  - PDF/DOCX: `Source: [Document Name] (Page [X])`
+  - Markdown/Text/JSON: `Source: [Document Name]`
+- Responses must be clean, structured, and concise. No speculation.
+
+Document passages:
+{context}"""
+    return ChatPromptTemplate.from_messages([
+        ("system", systemPrompt),
+        MessagesPlaceholder(variable_name="chat_history"),
+        ("human", "{input}"),
+    ])
+
+
+def answer_directly(llm, routeInfo, userQuery, chatHistoryMessages, appConfig, folderIndexes, invokeConfig, embeddingModel=None):
+    """Answers a routed question with a single LLM call (like build_rag in the LCEL archive)."""
+    chain = build_direct_answer_prompt(routeInfo["Route"]) | llm
+    chainInput = {"input": userQuery, "chat_history": chatHistoryMessages}
+    if routeInfo["Route"] == "rag":
+        chainInput["context"] = format_scored_passages(
+            routeInfo["ScoredDocs"], appConfig, (folderIndexes or {}).get("ParentStore"),
+            routeInfo.get("Query", userQuery), embeddingModel
+        )
+    # Streamed like agent answers, so console callbacks print tokens as they arrive
+    response = None
+    for chunk in chain.stream(chainInput, config=invokeConfig):
+        response = chunk if response is None else response + chunk
+    return format_agent_response(response.content if response is not None else "")
+
+
+def run_agent_turn(agentExecutor, agentInput, invokeConfig, appConfig):
+    """
+    Runs one agent turn. The async path lets AgentExecutor run all tool calls
+    of a step concurrently (e.g. document_search and web_search together).
+    """
+    if appConfig["AsyncAgentExecution"]:
+        return asyncio.run(agentExecutor.ainvoke(agentInput, config=invokeConfig))
+    return agentExecutor.invoke(agentInput, config=invokeConfig)
+
+def agent_was_stopped(result):
+    """True when AgentExecutor hit its iteration or time limit instead of finishing."""
+    return str(result.get("output", "")).startswith("Agent stopped due to")
+
+
+def synthesize_from_steps(llm, userQuery, chatHistoryMessages, intermediateSteps, invokeConfig):
+    """Forces a final answer from the tool results gathered before the agent budget ran out."""
+    gatheredContext = "\n\n".join(
+        f"[{action.tool}] {observation}" for action, observation in intermediateSteps
+    ) or "No information was gathered."
+    chain = build_direct_answer_prompt("rag") | llm
+    response = chain.invoke({
+        "input": userQuery,
+        "chat_history": chatHistoryMessages,
+        "context": gatheredContext
+    }, config=invokeConfig)
+    return format_agent_response(response.content)
+
+
+# Machine-readable agent instrumentation
+
+AGENT_EVENT_LOCK = threading.Lock()
+
+def emit_agent_event(appConfig, event):
+    """Appends one JSON event line to the agent event log."""
+    try:
+        eventPath = appConfig["AgentEventLogPath"]
+        if not eventPath:
+            return
+        event = {"timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(), **event}
+        with AGENT_EVENT_LOCK, open(eventPath, "a", encoding="utf-8") as eventFile:
+            eventFile.write(json.dumps(event, default=str) + "\n")
+    except Exception as e:
+        print(f"Error writing agent event: {e}")
+
+
+class AgentTimingHandler(BaseCallbackHandler):
+    """
+    Records per-iteration timings and token counts of one turn as events:
+    each LLM call (planning when it requests tools, synthesis otherwise)
+    and each tool call.
+    """
+
+    def __init__(self, appConfig, sessionId, turnId):
+        self.appConfig = appConfig
+        self.baseEvent = {"sessionId": sessionId, "turnId": turnId}
+        self.startTimes = {}
+        self.iteration = 0
+        self.inputTokens = 0
+        self.outputTokens = 0
+        self.hedgedCalls = 0
+        self.retriedCalls = 0
+
+    def start_timer(self, run_id):
+        self.startTimes[run_id] = time.perf_counter()
+
+    def elapsed_ms(self, run_id):
+        startedAt = self.startTimes.pop(run_id, None)
+        return round((time.perf_counter() - startedAt) * 1000, 1) if startedAt else None
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.start_timer(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.start_timer(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self.iteration += 1
+        message = getattr(response.generations[0][0], "message", None) if response.generations and response.generations[0] else None
+        usage = getattr(message, "usage_metadata", None) or {}
+        self.inputTokens += usage.get("input_tokens") or 0
+        self.outputTokens += usage.get("output_tokens") or 0
+        resilience = (getattr(message, "response_metadata", None) or {}).get("resilience", {})
+        self.hedgedCalls += 1 if resilience.get("hedged") else 0
+        self.retriedCalls += 1 if resilience.get("attempts", 1) > 1 else 0
+        emit_agent_event(self.appConfig, {
+            **self.baseEvent,
+            "event": "llm_call",
+            "phase": "planning" if getattr(message, "tool_calls", None) else "synthesis",
+            "iteration": self.iteration,
+            "durationMs": self.elapsed_ms(run_id),
+            "inputTokens": usage.get("input_tokens"),
+            "outputTokens": usage.get("output_tokens"),
+            "attempts": resilience.get("attempts", 1),
+            "hedged": resilience.get("hedged", False)
+        })
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        emit_agent_event(self.appConfig, {**self.baseEvent, "event": "llm_error",
+                                          "durationMs": self.elapsed_ms(run_id), "error": str(error)})
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self.start_timer(run_id)
+        self.startTimes[(run_id, "name")] = (serialized or {}).get("name", "tool")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        emit_agent_event(self.appConfig, {
+            **self.baseEvent,
+            "event": "tool_call",
+            "tool": self.startTimes.pop((run_id, "name"), "tool"),
+            "iteration": self.iteration,
+            "durationMs": self.elapsed_ms(run_id),
+            "outputTokens": count_tokens(str(output))
+        })
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        emit_agent_event(self.appConfig, {
+            **self.baseEvent,
+            "event": "tool_error",
+            "tool": self.startTimes.pop((run_id, "name"), "tool"),
+            "durationMs": self.elapsed_ms(run_id),
+            "error": str(error)
+        })
+
+
+class StreamingConsoleHandler(BaseCallbackHandler):
+    """
+    Prints LLM tokens as they arrive and shows tool calls while they run.
+    Tokens of each LLM call are collected separately; the text of the last
+    call is the streamed final answer.
+    """
+
+    def __init__(self):
+        self.currentTokens = []
+        self.headerPrinted = False
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.currentTokens = []
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.currentTokens = []
+
+    def on_llm_new_token(self, token, **kwargs):
+        text = token if isinstance(token, str) else format_agent_response(token)
+        if not text:
+            return
+        if not self.headerPrinted:
+            print("\nAssistant:")
+            self.headerPrinted = True
+        self.currentTokens.append(text)
+        print(text, end="", flush=True)
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        toolName = (serialized or {}).get("name", "tool")
+        print(f"\n[Calling {toolName}: {input_str}]", flush=True)
+
+    def on_tool_end(self, output, **kwargs):
+        print("[Tool finished]", flush=True)
+
+    def streamed_text(self):
+        return "".join(self.currentTokens)
+
 # Main Chat Loop
 
-def chat_loop(mongoDatabase, dbRecord, vectorStore, llm, appConfig, sessionId, webSearchEnabled=None):
+def chat_loop(mongoDatabase, dbRecord, vectorStore, llm, appConfig, sessionId, webSearchEnabled=None, folderIndexes=None):
     """Main chat loop with MongoDB-backed memory using Agent."""
     try:
        
@@ -643,7 +3063,7 @@ def chat_loop(mongoDatabase, dbRecord, vectorStore, llm, appConfig, sessionId, w
             webSearchEnabled = webChoice != 'n'
         
         
-        agent_executor = create_agent_executor(llm, vectorStore, appConfig, webSearchEnabled)
+        agent_executor = get_agent_executor(llm, vectorStore, appConfig, webSearchEnabled, folderIndexes, dbRecord["_id"])
         
         if agent_executor is None:
             print("Error: Failed to create agent executor.")
@@ -655,8 +3075,13 @@ def chat_loop(mongoDatabase, dbRecord, vectorStore, llm, appConfig, sessionId, w
             print("Error: Failed to connect to chat history.")
             return
         
-        # Load existing history as messages
-        historyMessages = load_history_as_messages(chatHistory)
+        # Load only the most recent history that fits the token budget
+        if appConfig["HistoryTokenBudget"] > 0:
+            historyState = load_recent_history(mongoDatabase, appConfig, sessionId)
+        else:
+            historyState = new_history_state(load_history_as_messages(chatHistory))
+        historyBudget = appConfig["HistoryTokenBudget"] if appConfig["HistoryTokenBudget"] > 0 else float("inf")
+        schedule_history_summary(mongoDatabase, llm, sessionId, historyState, appConfig)
         
         
         save_session_metadata(mongoDatabase, sessionId, dbRecord["_id"], dbRecord["FolderName"])
@@ -665,7 +3090,9 @@ def chat_loop(mongoDatabase, dbRecord, vectorStore, llm, appConfig, sessionId, w
         print(f"\nChat Started | Folder: {dbRecord['FolderName']}")
         print(f"Session ID: {sessionId}")
         print(f"Web Search: {webStatus}")
-        print(f"Loaded {len(historyMessages)} previous messages")
+        print(f"Loaded {len(historyState['Recent'])} previous messages ({historyState['OmittedCount']} older summarized)")
+        metaVectors = get_meta_question_vectors(vectorStore.embeddings) if appConfig["FastPathEnabled"] else None
+        rewriteCache = OrderedDict()
         print("Type 'exit' to quit.\n")
         
         while True:
@@ -679,25 +3106,124 @@ def chat_loop(mongoDatabase, dbRecord, vectorStore, llm, appConfig, sessionId, w
                 print("Thinking...", end="\r")
                 
                 try:
+                    # Follow-ups are condensed into a standalone question for retrieval and caching
+                    searchQuery = userQuery
+                    if appConfig["QueryRewriteEnabled"] and historyState["Recent"]:
+                        rawVector = vectorStore.embeddings.embed_query(userQuery)
+                        if looks_like_follow_up(userQuery, rawVector, (folderIndexes or {}).get("Centroid"), appConfig):
+                            searchQuery = condense_query(llm, userQuery, history_for_agent(historyState), rewriteCache)
+                    
+                    # Similar question answered earlier on the same folder: skip the agent
+                    responseCache = get_response_cache(appConfig) if appConfig["SemanticCacheEnabled"] else None
+                    cacheScope = get_semantic_cache_scope(dbRecord, webSearchEnabled)
+                    if responseCache:
+                        queryVector = vectorStore.embeddings.embed_query(searchQuery)
+                        cachedAnswer = responseCache.lookup_similar(cacheScope, queryVector, appConfig["SemanticCacheThreshold"])
+                        if cachedAnswer:
+                            print(f"\nAssistant (cached):\n{cachedAnswer}")
+                            chatHistory.add_user_message(userQuery)
+                            chatHistory.add_ai_message(cachedAnswer)
+                            add_turn_to_history(historyState, userQuery, cachedAnswer, historyBudget)
+                            save_session_metadata(mongoDatabase, sessionId, dbRecord["_id"], dbRecord["FolderName"])
+                            continue
+                    
+                    turnId = str(uuid.uuid4())
+                    turnStartedAt = time.perf_counter()
+                    timingHandler = AgentTimingHandler(appConfig, sessionId, turnId)
+                    # Every LLM request of the turn shares the turn deadline
+                    invokeConfig = {"callbacks": [timingHandler],
+                                    "metadata": {"TurnDeadline": time.monotonic() + appConfig["LlmTurnDeadlineSeconds"]}}
+                    streamHandler = None
+                    if appConfig["StreamResponses"]:
+                        streamHandler = StreamingConsoleHandler()
+                        invokeConfig["callbacks"].append(streamHandler)
+                    
+                    routeInfo = {"Route": "agent", "ScoredDocs": []}
+                    if appConfig["FastPathEnabled"]:
+                        routeInfo = route_query(userQuery, vectorStore, appConfig, folderIndexes, metaVectors, searchQuery)
+                    
+                    # The prompt makes document_search the agent's first call. With the fast path on
+                    # (the default) the router has already retrieved synchronously, so its result is
+                    # reused and nothing overlaps; only without a router result (fast_path_enabled=false
+                    # or a router error) does retrieval run alongside the first planning LLM call
+                    if routeInfo["Route"] == "agent" and appConfig["SpeculativeRetrievalEnabled"]:
+                        if "Query" in routeInfo:
+                            RETRIEVAL_PREFETCHER.store(vectorStore, routeInfo["Query"], routeInfo["ScoredDocs"], appConfig)
+                        else:
+                            RETRIEVAL_PREFETCHER.start(vectorStore, searchQuery, appConfig, (folderIndexes or {}).get("DocumentIndex"))
+                    
+                    turnInfo = {"ForcedFinal": False, "Steps": []}
                     
-                    result = agent_executor.invoke({
-                        "input": userQuery,
-                        "chat_history": historyMessages
+                    def execute_turn():
+                        if routeInfo["Route"] != "agent":
+                            directAnswer = answer_directly(llm, routeInfo, userQuery, history_for_agent(historyState),
+                                                           appConfig, folderIndexes, invokeConfig, vectorStore.embeddings)
+                            return directAnswer, routeInfo["Route"] == "rag"
+                        
+                        result = run_agent_turn(agent_executor, {
+                            "input": userQuery,
+                            "chat_history": history_for_agent(historyState)
+                        }, invokeConfig, appConfig)
+                        turnInfo["Steps"] = result.get("intermediate_steps", [])
+                        
+                        # Out of iterations or time: answer from what was gathered so far
+                        if agent_was_stopped(result):
+                            turnInfo["ForcedFinal"] = True
+                            forcedAnswer = synthesize_from_steps(llm, userQuery, history_for_agent(historyState),
+                                                                 result.get("intermediate_steps", []), invokeConfig)
+                            return forcedAnswer, used_retrieval_tools(result)
+                        
+                        # Get the answer and clean it
+                        rawAnswer = result.get("output", "No response generated.")
+                        return format_agent_response(rawAnswer), used_retrieval_tools(result)
+                    
+                    try:
+                        answer, isGrounded = execute_turn()
+                    except TimeoutError as e:
+                        emit_agent_event(appConfig, {"event": "turn", "sessionId": sessionId, "turnId": turnId,
+                                                     "route": routeInfo["Route"], "timedOut": True,
+                                                     "durationMs": round((time.perf_counter() - turnStartedAt) * 1000, 1)})
+                        print(f"\nThe assistant did not respond in time. Please try again. ({e})")
+                        continue
+                    
+                    emit_agent_event(appConfig, {
+                        "event": "turn",
+                        "sessionId": sessionId,
+                        "turnId": turnId,
+                        "route": routeInfo["Route"],
+                        "forcedFinal": turnInfo["ForcedFinal"],
+                        "hedgedCalls": timingHandler.hedgedCalls,
+                        "retriedCalls": timingHandler.retriedCalls,
+                        "timedOut": False,
+                        "durationMs": round((time.perf_counter() - turnStartedAt) * 1000, 1),
+                        "answerTokens": count_tokens(answer)
                     })
                     
-                    # Get the answer and clean it
-                    rawAnswer = result.get("output", "No response generated.")
-                    answer = format_agent_response(rawAnswer)
+                    # The full answer is only printed when it was not already streamed
+                    if streamHandler and streamHandler.streamed_text().strip():
+                        print()
+                    else:
+                        print(f"\nAssistant:\n{answer}")
+                    
+                    # Logged gate features + weak label feed the per-folder calibration
+                    if appConfig["RelevanceLogEnabled"] and routeInfo.get("Features") and (folderIndexes or {}).get("VectorPath"):
+                        append_relevance_log(folderIndexes["VectorPath"], userQuery, routeInfo["Features"], answer,
+                                             routeInfo["ScoredDocs"], vectorStore.embeddings, appConfig)
+                    
+                    # Web results the answer used are kept as local passages for this folder
+                    ingest_web_results(folderIndexes, turnInfo["Steps"], answer, appConfig)
                     
-                    print(f"\nAssistant:\n{answer}")
+                    # Only grounded answers are reused; meta-questions depend on the history
+                    if responseCache and isGrounded:
+                        responseCache.store_similar(cacheScope, searchQuery, queryVector, answer)
                     
                     # Save to MongoDB chat history
                     chatHistory.add_user_message(userQuery)
                     chatHistory.add_ai_message(answer)
                     
                     # Update local history for next iteration
-                    historyMessages.append(HumanMessage(content=userQuery))
-                    historyMessages.append(AIMessage(content=answer))
+                    add_turn_to_history(historyState, userQuery, answer, historyBudget)
+                    schedule_history_summary(mongoDatabase, llm, sessionId, historyState, appConfig)
                     
                     # Update session metadata
                     save_session_metadata(mongoDatabase, sessionId, dbRecord["_id"], dbRecord["FolderName"])
@@ -714,6 +3240,14 @@ def chat_loop(mongoDatabase, dbRecord, vectorStore, llm, appConfig, sessionId, w
                 continue
         
         print("\nChat ended. History saved to MongoDB.")
+        
+        if isinstance(vectorStore.embeddings, CachedQueryEmbeddings):
+            cacheStats = vectorStore.embeddings.stats()
+            print(f"Query embedding cache: {cacheStats['Hits']} hits, {cacheStats['Misses']} misses "
+                  f"({cacheStats['HitRate']:.0%} hit rate)")
+        poolStats = get_mongo_pool_metrics()
+        print(f"MongoDB pool: {poolStats['Open']} open, {poolStats['InUse']} in use, "
+              f"{poolStats['CheckOutFailed']} checkout failures")
     except Exception as e:
         print(f"Error in chat_loop: {e}")
         import traceback
@@ -740,12 +3274,12 @@ def start_new_chat(mongoDatabase, embeddingModel, appConfig):
         
         if folderRecord:
             
-            vectorStore = load_vector_store_local(folderRecord['VectorPath'], embeddingModel)
-            llm = get_gemini_llm(appConfig["GoogleApiKey"], model="gemini-2.5-flash", temperature=0.3)
+            vectorStore, folderIndexes = get_loaded_folder(folderRecord, embeddingModel)
+            llm = get_shared_llm(appConfig)
             
             if vectorStore and llm:
                 newSessionId = str(uuid.uuid4())
-                chat_loop(mongoDatabase, folderRecord, vectorStore, llm, appConfig, newSessionId)
+                chat_loop(mongoDatabase, folderRecord, vectorStore, llm, appConfig, newSessionId, folderIndexes=folderIndexes)
             else:
                 print("Error loading vector store or LLM.")
         else:
@@ -787,30 +3321,245 @@ def resume_previous_session(mongoDatabase, embeddingModel, appConfig):
             print("Error: The folder associated with this session no longer exists.")
             return
 
-        vectorStore = load_vector_store_local(folderRecord['VectorPath'], embeddingModel)
-        llm = get_gemini_llm(appConfig["GoogleApiKey"], model="gemini-2.5-flash", temperature=0.3)
+        vectorStore, folderIndexes = get_loaded_folder(folderRecord, embeddingModel)
+        llm = get_shared_llm(appConfig)
 
         if vectorStore and llm:
             print(f"\nResuming Chat: {folderRecord['FolderName']}")
-            chat_loop(mongoDatabase, folderRecord, vectorStore, llm, appConfig, sessionChoice)
+            chat_loop(mongoDatabase, folderRecord, vectorStore, llm, appConfig, sessionChoice, folderIndexes=folderIndexes)
         else:
             print("Error loading vector store or LLM.")
     except Exception as e:
         print(f"Error resuming session: {e}")
 
+def calibrate_relevance_gate(mongoDatabase, appConfig):
+    """Fits the relevance-gate thresholds of one folder from its logged queries."""
+    try:
+        folders = list(fetch_all_folders(mongoDatabase, appConfig["CollectionName"]))
+        if not folders:
+            print("No folders found. Run Option 1 first.")
+            return
+
+        print(f"\n{'ID':<38} | {'Folder Name':<20}")
+        print("-" * 60)
+        for doc in folders:
+            print(f"{str(doc['_id']):<38} | {doc['FolderName'][:20]:<20}")
+
+        folderRecord = fetch_folder_by_id(mongoDatabase, input("\nEnter Folder ID: ").strip(), appConfig["CollectionName"])
+        if not folderRecord:
+            print("Invalid ID.")
+            return
+
+        thresholds = fit_relevance_thresholds(folderRecord["VectorPath"])
+        if not thresholds.get("TopScore") and not thresholds.get("CrossScore"):
+            print("Not enough logged queries (need answers both supported and not supported by the documents).")
+            return
+        print(f"Calibrated thresholds saved: {thresholds}")
+
+        # Reload so new sessions on this folder use the calibrated thresholds
+        with LOADED_FOLDER_LOCK:
+            LOADED_FOLDER_CACHE.pop(folderRecord["VectorPath"], None)
+        with AGENT_EXECUTORS_LOCK:
+            for executorKey in [key for key in AGENT_EXECUTORS if key[0] == str(folderRecord["_id"])]:
+                del AGENT_EXECUTORS[executorKey]
+    except Exception as e:
+        print(f"Error calibrating relevance gate: {e}")
+
+# Batch question answering (non-interactive)
+
+CITATION_PATTERN = re.compile(r"Source:\s*(.+)")
+
+def load_batch_questions(inputPath):
+    """Reads questions from a JSONL file ({"id", "question"}) or a CSV file with id/question columns."""
+    questions = []
+    with open(inputPath, "r", encoding="utf-8", newline="") as inputFile:
+        if inputPath.lower().endswith(".csv"):
+            rows = list(csv.DictReader(inputFile))
+        else:
+            rows = [json.loads(line) for line in inputFile if line.strip()]
+    for position, row in enumerate(rows, start=1):
+        question = (row.get("question") or row.get("Question") or "").strip()
+        if question:
+            questionId = str(row.get("id") or row.get("Id") or position)
+            questions.append({"Id": questionId, "Question": question})
+    return questions
+
+def load_completed_batch_ids(outputPath):
+    """Ids already answered in a previous (partial) run; failed rows are retried."""
+    completedIds = set()
+    if not os.path.exists(outputPath):
+        return completedIds
+    with open(outputPath, "r", encoding="utf-8") as outputFile:
+        for line in outputFile:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not row.get("error"):
+                completedIds.add(str(row.get("id")))
+    return completedIds
+
+def answer_batch_question(question, vectorStore, llm, agentExecutor, appConfig, folderIndexes, batchId):
+    """Answers one stateless batch question and returns the output row."""
+    timingHandler = AgentTimingHandler(appConfig, batchId, question["Id"])
+    invokeConfig = {"callbacks": [timingHandler],
+                    "metadata": {"TurnDeadline": time.monotonic() + appConfig["LlmTurnDeadlineSeconds"]}}
+    startedAt = time.perf_counter()
+    routeInfo = {"Route": "agent", "ScoredDocs": []}
+    turnInfo = {"ForcedFinal": False, "Steps": []}
+    outputRow = {"id": question["Id"], "question": question["Question"]}
+    try:
+        if appConfig["FastPathEnabled"]:
+            routeInfo = route_query(question["Question"], vectorStore, appConfig, folderIndexes, None)
+        if routeInfo["Route"] == "agent" and appConfig["SpeculativeRetrievalEnabled"] and "Query" in routeInfo:
+            RETRIEVAL_PREFETCHER.store(vectorStore, routeInfo["Query"], routeInfo["ScoredDocs"], appConfig)
+
+        def execute_question():
+            if routeInfo["Route"] != "agent":
+                return answer_directly(llm, routeInfo, question["Question"], [], appConfig,
+                                       folderIndexes, invokeConfig, vectorStore.embeddings)
+            result = run_agent_turn(agentExecutor, {"input": question["Question"], "chat_history": []}, invokeConfig, appConfig)
+            turnInfo["Steps"] = result.get("intermediate_steps", [])
+            if agent_was_stopped(result):
+                turnInfo["ForcedFinal"] = True
+                return synthesize_from_steps(llm, question["Question"], [], result.get("intermediate_steps", []), invokeConfig)
+            return format_agent_response(result.get("output", "No response generated."))
+
+        answer = execute_question()
+        ingest_web_results(folderIndexes, turnInfo["Steps"], answer, appConfig)
+        outputRow.update({
+            "answer": answer,
+            "citations": sorted({citation.strip() for citation in CITATION_PATTERN.findall(answer)}),
+            "route": routeInfo["Route"],
+            "forcedFinal": turnInfo["ForcedFinal"],
+            "hedgedCalls": timingHandler.hedgedCalls,
+            "retriedCalls": timingHandler.retriedCalls,
+            "error": None
+        })
+    except Exception as e:
+        outputRow.update({"answer": None, "citations": [], "route": routeInfo["Route"], "error": str(e)})
+    outputRow.update({
+        "latencyMs": round((time.perf_counter() - startedAt) * 1000, 1),
+        "inputTokens": timingHandler.inputTokens,
+        "outputTokens": timingHandler.outputTokens
+    })
+    return outputRow
+
+def run_batch_questions(mongoDatabase, embeddingModel, appConfig, inputPath, folderId, outputPath, webSearchEnabled=False, useResponseCache=False):
+    """
+    Answers every question of an input file against one folder with bounded
+    concurrency. Rows are appended to a JSONL output file as they finish, so an
+    interrupted run resumes where it stopped. The response cache is off unless
+    useResponseCache is set, so regression runs exercise the current pipeline.
+    """
+    try:
+        folderRecord = fetch_folder_by_id(mongoDatabase, folderId, appConfig["CollectionName"])
+        if not folderRecord:
+            print("Invalid folder ID.")
+            return
+
+        questions = load_batch_questions(inputPath)
+        completedIds = load_completed_batch_ids(outputPath)
+        pendingQuestions = [q for q in questions if q["Id"] not in completedIds]
+        print(f"Batch: {len(questions)} questions, {len(questions) - len(pendingQuestions)} already answered.")
+        if not pendingQuestions:
+            return
+
+        # One loaded index, LLM client and agent executor shared by all workers
+        vectorStore, folderIndexes = get_loaded_folder(folderRecord, embeddingModel)
+        llm = get_shared_llm(appConfig, useResponseCache=useResponseCache)
+        if not vectorStore or not llm:
+            print("Error loading vector store or LLM.")
+            return
+        agentExecutor = get_agent_executor(llm, vectorStore, appConfig, webSearchEnabled, folderIndexes, folderRecord["_id"])
+        if agentExecutor is None:
+            print("Error: Failed to create agent executor.")
+            return
+
+        batchId = f"batch-{uuid.uuid4()}"
+        failedCount = 0
+        with ThreadPoolExecutor(max_workers=max(1, appConfig["BatchConcurrency"]), thread_name_prefix="batch") as batchExecutor, \
+                open(outputPath, "a", encoding="utf-8") as outputFile:
+            futures = [
+                batchExecutor.submit(answer_batch_question, question, vectorStore, llm, agentExecutor,
+                                     appConfig, folderIndexes, batchId)
+                for question in pendingQuestions
+            ]
+            for doneCount, future in enumerate(as_completed(futures), start=1):
+                outputRow = future.result()
+                failedCount += 1 if outputRow["error"] else 0
+                outputFile.write(json.dumps(outputRow, ensure_ascii=False) + "\n")
+                outputFile.flush()
+                print(f"[{doneCount}/{len(pendingQuestions)}] {outputRow['id']}: "
+                      f"{'failed' if outputRow['error'] else 'ok'} ({outputRow['latencyMs']} ms)")
+
+        print(f"Batch finished: {len(pendingQuestions) - failedCount} answered, {failedCount} failed. Output: {outputPath}")
+        print(f"MongoDB pool: {get_mongo_pool_metrics()}")
+    except Exception as e:
+        print(f"Error running batch: {e}")
+
+def run_batch_from_menu(mongoDatabase, embeddingModel, appConfig):
+    """Prompts for the batch inputs and runs it."""
+    try:
+        folders = list(fetch_all_folders(mongoDatabase, appConfig["CollectionName"]))
+        if not folders:
+            print("No folders found. Run Option 1 first.")
+            return
+
+        print(f"\n{'ID':<38} | {'Folder Name':<20}")
+        print("-" * 60)
+        for doc in folders:
+            print(f"{str(doc['_id']):<38} | {doc['FolderName'][:20]:<20}")
+
+        folderId = input("\nEnter Folder ID: ").strip()
+        inputPath = input("Questions file (.jsonl or .csv): ").strip()
+        if not os.path.exists(inputPath):
+            print("Questions file not found.")
+            return
+        outputPath = input("Output file [batch_answers.jsonl]: ").strip() or "batch_answers.jsonl"
+        webSearchEnabled = input("Enable web search? (y/N): ").strip().lower() == 'y'
+        useResponseCache = input("Reuse cached LLM responses? (y/N): ").strip().lower() == 'y'
+        run_batch_questions(mongoDatabase, embeddingModel, appConfig, inputPath, folderId, outputPath, webSearchEnabled, useResponseCache)
+    except Exception as e:
+        print(f"Error starting batch: {e}")
+
+def parse_command_line():
+    """Command-line options; without --batch the interactive menu runs."""
+    parser = argparse.ArgumentParser(description="BuzzBot QnA")
+    parser.add_argument("--batch", metavar="QUESTIONS_FILE", help="Answer questions from a .jsonl or .csv file and exit")
+    parser.add_argument("--folder", help="Folder ID to answer batch questions against")
+    parser.add_argument("--output", default="batch_answers.jsonl", help="JSONL output file (resumed if it exists)")
+    parser.add_argument("--web-search", action="store_true", help="Allow web search in batch mode")
+    parser.add_argument("--use-cache", action="store_true", help="Reuse cached LLM responses in batch mode (off by default)")
+    return parser.parse_args()
+
 def main():
     try:
+        commandLine = parse_command_line()
         appConfig = load_app_configuration()
-        embedModel = get_embedding_model()
+        embedModel = get_embedding_model(appConfig["QueryEmbeddingCacheSize"])
         mongoDatabase = connect_to_mongodb(appConfig) 
 
+        if commandLine.batch:
+            if not commandLine.folder:
+                print("--folder is required with --batch.")
+                sys.exit(2)
+            run_batch_questions(mongoDatabase, embedModel, appConfig, commandLine.batch,
+                                commandLine.folder, commandLine.output, commandLine.web_search, commandLine.use_cache)
+            return
+
+        if appConfig["WarmupEnabled"]:
+            start_warm_up(mongoDatabase, embedModel, appConfig)
+
         while True:
             try:
                 print("\n=== QnA Bot ===")
                 print("1. Process Static Folders (Scan PDF/Docs)")
                 print("2. Start New Chat")
                 print("3. Resume Previous Session")
-                print("4. Quit")
+                print("4. Calibrate Relevance Gate")
+                print("5. Run Batch Questions")
+                print("6. Quit")
                 userAction = input("Select: ")
                 
                 match userAction:
@@ -821,6 +3570,10 @@ def main():
                     case '3': 
                         resume_previous_session(mongoDatabase, embedModel, appConfig)
                     case '4': 
+                        calibrate_relevance_gate(mongoDatabase, appConfig)
+                    case '5': 
+                        run_batch_from_menu(mongoDatabase, embedModel, appConfig)
+                    case '6': 
                         break
                     case _:
                         print("Invalid selection.")
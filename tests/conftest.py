@@ -0,0 +1,51 @@
+"""Shared fixtures: the BuzzBot module loaded offline (fake LLM and search backends)."""
+
+import hashlib
+import importlib.util
+import os
+import re
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain")
+pytest.importorskip("faiss")
+
+from langchain_core.embeddings import Embeddings
+
+MODULE_PATH = Path(__file__).resolve().parent.parent / "BuzzBot-Using-Langchain.py"
+
+
+@pytest.fixture(scope="session")
+def buzzbot():
+    os.environ.update({
+        "mongo_url": "mongodb://localhost:1/", "llm_backend": "fake", "search_backend": "fake",
+        "agent_event_log_path": "", "vector_store_root": tempfile.mkdtemp()
+    })
+    spec = importlib.util.spec_from_file_location("buzzbot", MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class KeywordEmbeddings(Embeddings):
+    """Normalized hashed bag of words: texts sharing words score close, like a real embedding model."""
+
+    def __init__(self, size=64):
+        self.size = size
+
+    def embed_query(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.size] += 1.0
+        return (vector / (np.linalg.norm(vector) or 1.0)).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+@pytest.fixture
+def keywordEmbeddings():
+    return KeywordEmbeddings()
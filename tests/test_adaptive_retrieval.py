@@ -0,0 +1,33 @@
+"""Adaptive retrieval depth: score threshold plus a gap measured from the top hit."""
+
+from langchain_core.documents import Document
+
+
+class ScoredStore:
+    """Stands in for a FAISS store that returns preset relevance scores."""
+
+    def __init__(self, scores):
+        self.scoredDocs = [(Document(page_content=f"chunk {i}"), score) for i, score in enumerate(scores)]
+
+    def similarity_search_with_relevance_scores(self, query, k):
+        return self.scoredDocs[:k]
+
+
+def adaptive_scores(buzzbot, scores, threshold=0.3, gap=0.15):
+    appConfig = dict(buzzbot.load_app_configuration(), RetrieverK=len(scores),
+                     RetrieverScoreThreshold=threshold, RetrieverScoreGap=gap)
+    return [score for _, score in buzzbot.search_with_adaptive_k(ScoredStore(scores), "query", appConfig)]
+
+
+def test_gap_is_measured_from_the_top_hit(buzzbot):
+    # Each step is within the gap of the previous hit, but 0.74 is 0.16 below the top
+    assert adaptive_scores(buzzbot, [0.9, 0.82, 0.74, 0.66]) == [0.9, 0.82]
+
+
+def test_close_hits_are_all_kept(buzzbot):
+    assert adaptive_scores(buzzbot, [0.62, 0.6, 0.55, 0.5]) == [0.62, 0.6, 0.55, 0.5]
+
+
+def test_hits_below_the_threshold_are_dropped(buzzbot):
+    assert adaptive_scores(buzzbot, [0.4, 0.35, 0.29, 0.28]) == [0.4, 0.35]
+    assert adaptive_scores(buzzbot, [0.2, 0.1]) == []
@@ -0,0 +1,77 @@
+"""Two-stage retrieval: chunks are searched only inside the best-matching files."""
+
+import os
+import time
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+
+class FixedQueryEmbeddings(Embeddings):
+    """Returns one preset vector for every query; documents are added with their own vectors."""
+
+    def __init__(self, queryVector):
+        self.queryVector = queryVector
+
+    def embed_query(self, text):
+        return self.queryVector.tolist()
+
+    def embed_documents(self, texts):
+        return [self.queryVector.tolist() for _ in texts]
+
+
+def build_folder(buzzbot, fileCount, chunksPerFile, dimensions, seed=0):
+    """Random unit chunk vectors, clustered per file, plus a query near file 0."""
+    rng = np.random.default_rng(seed)
+    fileCenters = rng.standard_normal((fileCount, dimensions)).astype(np.float32)
+    chunkVectors = np.repeat(fileCenters, chunksPerFile, axis=0) + 0.5 * rng.standard_normal((fileCount * chunksPerFile, dimensions)).astype(np.float32)
+    chunkVectors /= np.linalg.norm(chunkVectors, axis=1, keepdims=True)
+    queryVector = chunkVectors[0] + 0.05 * rng.standard_normal(dimensions).astype(np.float32)
+    queryVector /= np.linalg.norm(queryVector)
+
+    embeddings = FixedQueryEmbeddings(queryVector)
+    textEmbeddings = [(f"chunk {i}", vector.tolist()) for i, vector in enumerate(chunkVectors)]
+    metadatas = [{"source": f"file{i // chunksPerFile}.txt"} for i in range(len(chunkVectors))]
+    vectorStore = buzzbot.FAISS.from_embeddings(textEmbeddings, embeddings, metadatas=metadatas)
+    documentIndex = buzzbot.build_document_index(vectorStore, embeddings)
+    return vectorStore, documentIndex, chunkVectors, queryVector
+
+
+def test_two_stage_search_matches_brute_force_over_selected_files(buzzbot):
+    appConfig = dict(buzzbot.load_app_configuration(), RetrieverK=5, DocumentTopN=2)
+    vectorStore, documentIndex, chunkVectors, queryVector = build_folder(buzzbot, fileCount=6, chunksPerFile=20, dimensions=32)
+
+    scoredDocs = buzzbot.search_within_documents(vectorStore, documentIndex, "query", appConfig)
+
+    topFiles = {doc.metadata["source"] for doc in documentIndex.similarity_search_by_vector(queryVector.tolist(), k=2)}
+    candidatePositions = [i for i in range(len(chunkVectors)) if f"file{i // 20}.txt" in topFiles]
+    distances = np.sum((chunkVectors[candidatePositions] - queryVector) ** 2, axis=1)
+    expectedTexts = [f"chunk {candidatePositions[i]}" for i in np.argsort(distances)[:5]]
+
+    assert [doc.page_content for doc, _ in scoredDocs] == expectedTexts
+    assert all(doc.metadata["source"] in topFiles for doc, _ in scoredDocs)
+    assert all(isinstance(score, float) for _, score in scoredDocs)
+    scores = [score for _, score in scoredDocs]
+    assert scores == sorted(scores, reverse=True)
+    assert scores[0] == pytest.approx(vectorStore._select_relevance_score_fn()(float(np.min(distances))), abs=1e-4)
+
+
+@pytest.mark.skipif(not os.getenv("buzzbot_benchmark"), reason="set buzzbot_benchmark=1 to run")
+def test_two_stage_search_is_faster_than_flat_search(buzzbot):
+    # 20,000 chunks x 384 dimensions in 100 files; the top 30 files hold 6,000 chunks
+    appConfig = dict(buzzbot.load_app_configuration(), RetrieverK=8, DocumentTopN=30)
+    vectorStore, documentIndex, _, queryVector = build_folder(buzzbot, fileCount=100, chunksPerFile=200, dimensions=384)
+    queryBatch = queryVector.reshape(1, -1)
+
+    def average_ms(searchFn, repeats=50):
+        searchFn()
+        startedAt = time.perf_counter()
+        for _ in range(repeats):
+            searchFn()
+        return (time.perf_counter() - startedAt) / repeats * 1000
+
+    flatMs = average_ms(lambda: vectorStore.index.search(queryBatch, appConfig["RetrieverK"]))
+    twoStageMs = average_ms(lambda: buzzbot.search_within_documents(vectorStore, documentIndex, "query", appConfig))
+    print(f"\nflat IndexFlatL2.search: {flatMs:.2f} ms, two-stage search_within_documents: {twoStageMs:.2f} ms")
+    assert twoStageMs < flatMs
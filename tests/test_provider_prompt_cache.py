@@ -0,0 +1,135 @@
+"""
+Provider prompt caching against a stub cachedContents server: the static prefix
+is registered once, and agent requests then carry cached_content without tools.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+@pytest.fixture
+def stubServer():
+    receivedRequests = []
+
+    class CachedContentsHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            requestBody = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            receivedRequests.append({"path": self.path, "body": requestBody})
+            responseBody = json.dumps({"name": f"cachedContents/stub-{len(receivedRequests)}"}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(responseBody)))
+            self.end_headers()
+            self.wfile.write(responseBody)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CachedContentsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}", receivedRequests
+    server.shutdown()
+
+
+class RecordingChatModel(BaseChatModel):
+    """Answers directly and records the request arguments of every call."""
+
+    model: str = "models/gemini-stub"
+    calls: list = []
+
+    @property
+    def _llm_type(self):
+        return "recording"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[t.name for t in tools], **kwargs)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls.append({"messages": messages, "kwargs": kwargs})
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="Mute it from the channel menu."))])
+
+
+def make_app_config(buzzbot, endpoint):
+    appConfig = buzzbot.load_app_configuration()
+    appConfig.update({"LlmBackend": "gemini", "ProviderPromptCacheEnabled": True,
+                      "ProviderPromptCacheEndpoint": endpoint, "GoogleApiKey": "test-key"})
+    return appConfig
+
+
+def make_vector_store(buzzbot):
+    documents = [Document(page_content="Mute a channel from its menu.", metadata={"source": "mute.md"})]
+    return buzzbot.FAISS.from_documents(documents, DeterministicFakeEmbedding(size=32))
+
+
+def test_register_prompt_prefix_posts_prefix_once(buzzbot, stubServer):
+    endpoint, receivedRequests = stubServer
+    buzzbot.PROVIDER_PREFIX_CACHES.clear()
+    appConfig = make_app_config(buzzbot, endpoint)
+    promptPrefix = {"Hash": "a" * 64, "Text": "prefix", "ToolSchemas": [{"name": "search", "parameters": {}}]}
+
+    firstName = buzzbot.register_prompt_prefix(appConfig, "gemini-stub", "You are Buzz.", promptPrefix)
+    secondName = buzzbot.register_prompt_prefix(appConfig, "gemini-stub", "You are Buzz.", promptPrefix)
+
+    assert firstName == secondName == "cachedContents/stub-1"
+    assert len(receivedRequests) == 1
+    assert receivedRequests[0]["path"] == "/v1beta/cachedContents?key=test-key"
+    requestBody = receivedRequests[0]["body"]
+    assert requestBody["model"] == "models/gemini-stub"
+    assert requestBody["systemInstruction"] == {"parts": [{"text": "You are Buzz."}]}
+    assert requestBody["tools"] == [{"functionDeclarations": promptPrefix["ToolSchemas"]}]
+    assert requestBody["ttl"] == f"{appConfig['ProviderPromptCacheTtlSeconds']}s"
+
+
+def test_register_prompt_prefix_returns_none_when_server_unreachable(buzzbot):
+    buzzbot.PROVIDER_PREFIX_CACHES.clear()
+    appConfig = make_app_config(buzzbot, "http://127.0.0.1:9")
+    promptPrefix = {"Hash": "b" * 64, "Text": "prefix", "ToolSchemas": []}
+
+    assert buzzbot.register_prompt_prefix(appConfig, "gemini-stub", "You are Buzz.", promptPrefix) is None
+
+
+def test_agent_requests_send_cached_content_without_tools(buzzbot, stubServer):
+    endpoint, receivedRequests = stubServer
+    buzzbot.PROVIDER_PREFIX_CACHES.clear()
+    appConfig = make_app_config(buzzbot, endpoint)
+    innerModel = RecordingChatModel(calls=[])
+    llm = buzzbot.ResilientChatModel(innerModel=innerModel, appConfig=appConfig)
+
+    executor = buzzbot.create_agent_executor(llm, make_vector_store(buzzbot), appConfig, webSearchEnabled=False)
+    result = executor.invoke({"input": "How do I mute a channel?", "chat_history": []})
+
+    assert result["output"] == "Mute it from the channel menu."
+    assert len(receivedRequests) == 1
+    assert receivedRequests[0]["body"]["model"] == "models/gemini-stub"
+    assert executor.metadata["ProviderCacheName"] == "cachedContents/stub-1"
+    assert innerModel.calls
+    for call in innerModel.calls:
+        assert call["kwargs"].get("cached_content") == "cachedContents/stub-1"
+        assert "tools" not in call["kwargs"]
+        assert all(message.type != "system" for message in call["messages"])
+
+
+def test_agent_requests_send_tools_without_provider_cache(buzzbot):
+    buzzbot.PROVIDER_PREFIX_CACHES.clear()
+    appConfig = make_app_config(buzzbot, "http://127.0.0.1:9")
+    innerModel = RecordingChatModel(calls=[])
+    llm = buzzbot.ResilientChatModel(innerModel=innerModel, appConfig=appConfig)
+
+    executor = buzzbot.create_agent_executor(llm, make_vector_store(buzzbot), appConfig, webSearchEnabled=False)
+    executor.invoke({"input": "How do I mute a channel?", "chat_history": []})
+
+    assert executor.metadata["ProviderCacheName"] is None
+    assert innerModel.calls
+    for call in innerModel.calls:
+        assert "cached_content" not in call["kwargs"]
+        assert "tools" in call["kwargs"]
+        assert call["messages"][0].type == "system"
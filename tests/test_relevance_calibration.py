@@ -0,0 +1,35 @@
+"""Relevance gate logging and threshold fitting on a small folder (flat FAISS search path)."""
+
+from langchain_core.documents import Document
+
+FOLDER_TEXTS = [
+    "To mute a channel open the channel menu and choose mute notifications.",
+    "Buzz Pro costs five dollars per month and adds unlimited message history.",
+]
+
+
+def test_flat_path_turns_are_logged_and_fitted(buzzbot, keywordEmbeddings, tmp_path):
+    appConfig = buzzbot.load_app_configuration()
+    documents = [Document(page_content=text, metadata={"source": f"doc{i}.txt"}) for i, text in enumerate(FOLDER_TEXTS)]
+    vectorStore = buzzbot.FAISS.from_documents(documents, keywordEmbeddings)
+    # At most DocumentTopN files: retrieval takes the flat search path
+    assert len(documents) <= appConfig["DocumentTopN"]
+
+    turns = [
+        ("How do I mute a channel?", "Open the channel menu and choose mute notifications."),
+        ("What does Buzz Pro cost?", "Buzz Pro costs five dollars per month."),
+        ("Who won the football match?", "The home team won three to one on Sunday."),
+        ("What is the weather in Paris?", "It is sunny and warm in Paris today."),
+    ]
+    for query, answer in turns:
+        scoredDocs = buzzbot.search_with_adaptive_k(vectorStore, query, dict(appConfig, RetrieverScoreThreshold=0.0))
+        features = buzzbot.relevance_features(query, scoredDocs, appConfig)
+        buzzbot.append_relevance_log(str(tmp_path), query, features, answer, scoredDocs, keywordEmbeddings, appConfig)
+
+    logLines = (tmp_path / "relevance_log.jsonl").read_text(encoding="utf-8").splitlines()
+    assert len(logLines) == len(turns)
+
+    thresholds = buzzbot.fit_relevance_thresholds(str(tmp_path))
+    assert thresholds["SampleCount"] == len(turns)
+    assert thresholds["TopScoreBalancedAccuracy"] == 1.0
+    assert buzzbot.load_relevance_thresholds(str(tmp_path))["TopScore"] == thresholds["TopScore"]
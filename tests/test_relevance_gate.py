@@ -0,0 +1,54 @@
+"""document_search relevance gate: web fallback only for on-topic questions, passages kept."""
+
+from langchain_core.documents import Document
+
+
+def make_search_tool(buzzbot, keywordEmbeddings, webQueries, gateThreshold):
+    appConfig = buzzbot.load_app_configuration()
+    appConfig.update({"RelevanceGateEnabled": True, "RelevanceGateThreshold": gateThreshold,
+                      "RetrieverScoreThreshold": 0.0, "SpeculativeRetrievalEnabled": False,
+                      "ContextCompressionEnabled": False, "RelevanceCrossEncoderModel": ""})
+    documents = [
+        Document(page_content="To mute a channel open the channel menu and choose mute.", metadata={"source": "mute.txt"}),
+        Document(page_content="Who won a football match is not covered by Buzz support.", metadata={"source": "scope.txt"}),
+    ]
+    vectorStore = buzzbot.FAISS.from_documents(documents, keywordEmbeddings)
+
+    def web_search(query):
+        webQueries.append(query)
+        return "Web Results:\n\n[1] Result\n    Snippet\n    Link: https://example.com/1"
+
+    return buzzbot.create_rag_search_tool(vectorStore, appConfig, webSearchFn=web_search)
+
+
+def test_off_topic_question_keeps_passages_without_web_search(buzzbot, keywordEmbeddings):
+    webQueries = []
+    searchTool = make_search_tool(buzzbot, keywordEmbeddings, webQueries, gateThreshold=0.99)
+
+    observation = searchTool.func("Who won the football match?")
+
+    assert webQueries == []
+    assert "may be insufficient" in observation
+    assert "scope.txt" in observation
+    assert buzzbot.WEB_FALLBACK_MARKER not in observation
+
+
+def test_on_topic_question_falls_back_to_web_with_passages(buzzbot, keywordEmbeddings):
+    webQueries = []
+    searchTool = make_search_tool(buzzbot, keywordEmbeddings, webQueries, gateThreshold=0.99)
+
+    observation = searchTool.func("How do I mute a channel?")
+
+    assert webQueries == ["How do I mute a channel?"]
+    assert "mute.txt" in observation
+    assert buzzbot.WEB_FALLBACK_MARKER in observation
+
+
+def test_sufficient_documents_skip_web_search(buzzbot, keywordEmbeddings):
+    webQueries = []
+    searchTool = make_search_tool(buzzbot, keywordEmbeddings, webQueries, gateThreshold=0.0)
+
+    observation = searchTool.func("How do I mute a channel?")
+
+    assert webQueries == []
+    assert observation.startswith("[1] Source: mute.txt")
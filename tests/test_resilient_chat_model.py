@@ -0,0 +1,111 @@
+"""Per-request deadline, retries and hedging of ResilientChatModel against a scripted stub model."""
+
+import threading
+import time
+
+import pytest
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Plays one scripted step per call: {"Delay": seconds, "Error": exception or None, "Text": answer}."""
+
+    steps: list
+    callCount: int = 0
+    lock: object = None
+
+    def model_post_init(self, context):
+        self.lock = threading.Lock()
+
+    @property
+    def _llm_type(self):
+        return "scripted"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        with self.lock:
+            step = self.steps[min(self.callCount, len(self.steps) - 1)]
+            self.callCount += 1
+        time.sleep(step.get("Delay", 0.0))
+        if step.get("Error") is not None:
+            raise step["Error"]
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=step["Text"]))])
+
+
+def make_model(buzzbot, steps, **configOverrides):
+    appConfig = dict(buzzbot.load_app_configuration(), LlmAttemptTimeoutSeconds=2.0, LlmTurnDeadlineSeconds=5.0,
+                     LlmMaxRetries=2, LlmBackoffBaseSeconds=0.01, LlmHedgingEnabled=False)
+    appConfig.update(configOverrides)
+    innerModel = ScriptedChatModel(steps=steps)
+    return buzzbot.ResilientChatModel(innerModel=innerModel, appConfig=appConfig), innerModel
+
+
+@pytest.fixture
+def latencyTracker(buzzbot, monkeypatch):
+    tracker = buzzbot.LatencyTracker()
+    monkeypatch.setattr(buzzbot, "LLM_LATENCY_TRACKER", tracker)
+    return tracker
+
+
+def test_hedge_wins_over_slow_attempt(buzzbot, latencyTracker):
+    for _ in range(20):
+        latencyTracker.record(0.05)
+    llm, innerModel = make_model(buzzbot, [{"Delay": 3.0, "Text": "slow"}, {"Text": "hedged"}],
+                                 LlmHedgingEnabled=True, LlmHedgeMinSamples=20)
+
+    startedAt = time.monotonic()
+    response = llm.invoke("How do I mute a channel?")
+
+    assert response.content == "hedged"
+    assert response.response_metadata["resilience"] == {"attempts": 1, "hedged": True}
+    assert innerModel.callCount == 2
+    assert time.monotonic() - startedAt < 1.0
+
+
+def test_no_hedge_before_enough_latency_samples(buzzbot, latencyTracker):
+    llm, innerModel = make_model(buzzbot, [{"Delay": 0.2, "Text": "primary"}],
+                                 LlmHedgingEnabled=True, LlmHedgeMinSamples=20)
+
+    assert llm.invoke("How do I mute a channel?").content == "primary"
+    assert innerModel.callCount == 1
+
+
+def test_service_unavailable_is_retried(buzzbot, latencyTracker):
+    llm, innerModel = make_model(buzzbot, [{"Error": RuntimeError("503 Service Unavailable")}, {"Text": "recovered"}])
+
+    response = llm.invoke("How do I mute a channel?")
+
+    assert response.content == "recovered"
+    assert response.response_metadata["resilience"] == {"attempts": 2, "hedged": False}
+    assert innerModel.callCount == 2
+
+
+def test_non_retryable_error_is_raised_at_once(buzzbot, latencyTracker):
+    llm, innerModel = make_model(buzzbot, [{"Error": ValueError("400 invalid argument")}, {"Text": "unused"}])
+
+    with pytest.raises(ValueError):
+        llm.invoke("How do I mute a channel?")
+    assert innerModel.callCount == 1
+
+
+def test_turn_deadline_stops_retries(buzzbot, latencyTracker):
+    llm, innerModel = make_model(buzzbot, [{"Delay": 5.0, "Text": "too late"}],
+                                 LlmAttemptTimeoutSeconds=0.2, LlmTurnDeadlineSeconds=0.5)
+
+    startedAt = time.monotonic()
+    with pytest.raises(TimeoutError):
+        llm.invoke("How do I mute a channel?")
+
+    assert time.monotonic() - startedAt < 1.5
+    assert 1 <= innerModel.callCount <= 3
+
+
+def test_turn_deadline_from_run_metadata(buzzbot, latencyTracker):
+    llm, _ = make_model(buzzbot, [{"Delay": 5.0, "Text": "too late"}], LlmTurnDeadlineSeconds=60.0)
+
+    startedAt = time.monotonic()
+    with pytest.raises(TimeoutError):
+        llm.invoke("How do I mute a channel?", config={"metadata": {"TurnDeadline": time.monotonic() + 0.3}})
+
+    assert time.monotonic() - startedAt < 1.5
@@ -0,0 +1,16 @@
+"""Shared LLM registry: batch runs get a wrapper that bypasses the response cache."""
+
+
+def test_uncached_wrapper_shares_the_client_without_the_response_cache(buzzbot, tmp_path, monkeypatch):
+    monkeypatch.setattr(buzzbot, "LLM_CLIENTS", {})
+    appConfig = dict(buzzbot.load_app_configuration(), LlmBackend="gemini", GoogleApiKey="test-key",
+                     LlmCacheEnabled=True, LlmCachePath=str(tmp_path / "llm_cache.sqlite"))
+
+    cachedLlm = buzzbot.get_shared_llm(appConfig)
+    uncachedLlm = buzzbot.get_shared_llm(appConfig, useResponseCache=False)
+
+    assert cachedLlm.responseCache is not None
+    assert uncachedLlm.responseCache is None
+    assert uncachedLlm.innerModel is cachedLlm.innerModel
+    # Stable per process, so the agent executor cache keyed by the client is reused across batch runs
+    assert buzzbot.get_shared_llm(appConfig, useResponseCache=False) is uncachedLlm
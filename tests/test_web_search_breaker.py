@@ -0,0 +1,130 @@
+"""Web search deadline and circuit breaker against a delayed stub SerpAPI server (serpapi_endpoint)."""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ORGANIC_RESULTS = {"search_metadata": {"status": "Success"},
+                   "organic_results": [{"title": "Muting in Buzz", "snippet": "Open the channel menu.", "link": "https://example.com/mute"}]}
+QUOTA_ERROR = {"search_metadata": {"status": "Error"}, "error": "Your account has run out of searches."}
+NO_RESULTS = {"search_metadata": {"status": "Success"}, "error": "Google hasn't returned any results for this query."}
+
+
+@pytest.fixture
+def stubSerpApi():
+    """Stub /search endpoint; set behaviour["Delay"] and behaviour["Body"] per test."""
+    behaviour = {"Delay": 0.0, "Body": ORGANIC_RESULTS, "Requests": []}
+
+    class SearchHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            behaviour["Requests"].append(self.path)
+            time.sleep(behaviour["Delay"])
+            responseBody = json.dumps(behaviour["Body"]).encode("utf-8")
+            try:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(responseBody)))
+                self.end_headers()
+                self.wfile.write(responseBody)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SearchHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    behaviour["Endpoint"] = f"http://127.0.0.1:{server.server_port}"
+    yield behaviour
+    server.shutdown()
+
+
+@pytest.fixture
+def searchTool(buzzbot, stubSerpApi, monkeypatch):
+    monkeypatch.setenv("serpapi_endpoint", stubSerpApi["Endpoint"])
+    monkeypatch.setenv("search_backend", "serpapi")
+    monkeypatch.setenv("serpapi_api_key", "test-key")
+    monkeypatch.setenv("web_search_cache_enabled", "false")
+    monkeypatch.setenv("web_search_deadline_seconds", "0.3")
+    monkeypatch.setenv("web_search_breaker_failures", "2")
+    monkeypatch.setenv("web_search_breaker_cooldown_seconds", "0.5")
+    monkeypatch.setattr(buzzbot, "WEB_SEARCH_BREAKER", None)
+    monkeypatch.setattr(buzzbot, "SEARCH_CLIENTS", {})
+    appConfig = buzzbot.load_app_configuration()
+    return buzzbot.create_web_search_tool(appConfig), buzzbot.get_web_search_breaker(appConfig)
+
+
+def test_results_come_from_the_configured_endpoint(buzzbot, stubSerpApi, searchTool):
+    webSearch, breaker = searchTool
+
+    observation = webSearch.func("mute a channel")
+
+    assert "Link: https://example.com/mute" in observation
+    assert len(stubSerpApi["Requests"]) == 1
+    assert stubSerpApi["Requests"][0].startswith("/search?")
+    assert "api_key=test-key" in stubSerpApi["Requests"][0]
+    assert breaker.state() == "closed"
+
+
+def test_slow_search_is_cut_off_at_the_deadline(buzzbot, stubSerpApi, searchTool):
+    webSearch, breaker = searchTool
+    stubSerpApi["Delay"] = 2.0
+
+    startedAt = time.monotonic()
+    observation = webSearch.func("mute a channel")
+
+    assert observation == buzzbot.WEB_SEARCH_UNAVAILABLE
+    assert time.monotonic() - startedAt < 1.0
+    assert breaker.consecutiveFailures == 1
+
+
+def test_client_socket_timeout_applies_without_the_executor_deadline(buzzbot, stubSerpApi):
+    stubSerpApi["Delay"] = 2.0
+    client = buzzbot.SerpApiHttpClient(stubSerpApi["Endpoint"], "test-key", 0.3)
+
+    startedAt = time.monotonic()
+    with pytest.raises(OSError):
+        client.results("mute a channel")
+    assert time.monotonic() - startedAt < 1.0
+
+
+def test_breaker_opens_skips_calls_and_probes_after_cooldown(buzzbot, stubSerpApi, searchTool):
+    webSearch, breaker = searchTool
+    stubSerpApi["Body"] = QUOTA_ERROR
+
+    # API errors arrive as a normal response body and still count as failures
+    assert webSearch.func("first") == buzzbot.WEB_SEARCH_UNAVAILABLE
+    assert webSearch.func("second") == buzzbot.WEB_SEARCH_UNAVAILABLE
+    assert breaker.state() == "open"
+
+    # While open, calls are skipped without reaching the server
+    assert webSearch.func("third") == buzzbot.WEB_SEARCH_UNAVAILABLE
+    assert len(stubSerpApi["Requests"]) == 2
+
+    # After the cool-down one probe goes out; a failed probe re-opens the breaker
+    time.sleep(0.6)
+    assert webSearch.func("probe") == buzzbot.WEB_SEARCH_UNAVAILABLE
+    assert len(stubSerpApi["Requests"]) == 3
+    assert breaker.state() == "open"
+    assert webSearch.func("skipped") == buzzbot.WEB_SEARCH_UNAVAILABLE
+    assert len(stubSerpApi["Requests"]) == 3
+
+    # A successful probe closes it again
+    time.sleep(0.6)
+    stubSerpApi["Body"] = ORGANIC_RESULTS
+    assert "Link: https://example.com/mute" in webSearch.func("recovered")
+    assert breaker.state() == "closed"
+    assert len(stubSerpApi["Requests"]) == 4
+
+
+def test_empty_result_set_is_not_a_failure(buzzbot, stubSerpApi, searchTool):
+    webSearch, breaker = searchTool
+    stubSerpApi["Body"] = NO_RESULTS
+
+    for query in ("first", "second", "third"):
+        assert webSearch.func(query) == "No web results found for this query."
+    assert breaker.state() == "closed"
+    assert len(stubSerpApi["Requests"]) == 3